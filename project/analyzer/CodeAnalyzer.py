@@ -1,16 +1,77 @@
 import os
 import re
+import functools
+import hashlib
+import json
 import sys
-import subprocess
 import tempfile
+import threading
+import subprocess
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from clang import cindex
+from .PreprocLineMap import PreprocLineMap
+from .DebugLog import getDebugLogger, flushDebugLog
 
 # 追加: デバッグON/OFF（要求: 7行めに DEBUG=1 を置いて if で print）
 DEBUG = 1
+_DBG_LOG = getDebugLogger("CodeAnalyzerDBG")
+
+# プリプロセス結果のキャッシュ（プロセス内）
+# ソース絶対パス -> (キー, (プリプロセス後の仮想パス, プリプロセス後テキスト, preproc_map))
+# キー: (ソース絶対パス, compile_args, ソース内容の sha1, カレントディレクトリ, include 系の環境変数)
+# 修正のたびに内容が変わるので、ソースごとに最新の 1件だけを持つ（古い内容の結果は捨てる）
+_PREPROCESS_CACHE = {}
+
+# clang -E の結果のディスクキャッシュ（プロセスをまたいで使う）
+# CHENGE_CACHE_DIR にディレクトリを指定したときだけ使う（未設定/空文字なら使わない）。
+# 件数の上限や掃除は行わないので、不要になったらディレクトリごと消すこと
+_DISK_CACHE_DIR = os.environ.get("CHENGE_CACHE_DIR", "")
+
+# clang -E の出力を変える環境変数（プリプロセスのキャッシュキーに含める）
+_PREPROCESS_ENV_VARS = ("CPATH", "C_INCLUDE_PATH")
+
+# TranslationUnit のキャッシュ（プロセス内）
+# key: (プリプロセス後の仮想パス, compile_args) -> (parse したプリプロセス後テキスト, TranslationUnit, 位置キャッシュ, token キャッシュ, token 範囲キャッシュ, AST 由来の表のキャッシュ)
+# 同じ内容なら TU をそのまま使い回す。ソースが更新されていたら新しい TU を parse してエントリを差し替える
+# （古い TU は reparse しない。先に作った CodeAnalyzer の self.tu / cursor / キャッシュは古いテキストのまま使える）
+_TU_CACHE = {}
+# _TU_CACHE のキーごとのロック。TU の取得（同じ TU を二重に parse しない）だけでなく、
+# all_AST の解析中も持つ（同じ TU の cursor / token と共有キャッシュを複数スレッドから同時に触らない）
+_TU_CACHE_LOCK = threading.Lock()
+_TU_KEY_LOCKS = {}
+# CodeAnalyzer._shared_index（libclang の設定と Index の作成）を初期化するときのロック
+_INDEX_LOCK = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _clang_version():
+    """clang --version の出力（ディスクキャッシュのキー用。プロセス内で 1回だけ実行する）。取れなければ空文字。"""
+    try:
+        return subprocess.run(["clang", "--version"], stdout=subprocess.PIPE, text=True, errors="ignore").stdout.strip()
+    except Exception:
+        return ""
+
+# よく使う正規表現はモジュール読み込み時に 1回だけコンパイルしておく
+# プリプロセス後ファイルの linemarker（# 12 "foo.c" ...）。テキスト全体に finditer する（行頭の空白を許し、改行はまたがない）
+_LINE_DIRECTIVE_SCAN_RE = re.compile(r'^[^\S\n]*#[^\S\n]*(\d+)[^\S\n]+"([^"\n]+)"', re.M)
+_HSPACE_RE = re.compile(r"[ \t]+")
+_SPACES_RE = re.compile(r"\s+")
+_LEADING_SPACES_RE = re.compile(r"^\s*")
+_OPEN_PAREN_SPACES_RE = re.compile(r"\(\s*")
+_CLOSE_PAREN_SPACES_RE = re.compile(r"\s*\)")
+_CLOSE_PAREN_GAP_RE = re.compile(r"\)\s+([A-Za-z_0-9\*])")
+_PLUS_SPACES_RE = re.compile(r"\s*\+\s*")
+_IDENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
 
 class CodeAnalyzer:
     # compile:      指定された行の式を分析用のjsonデータにコンパイルする
     # decompile:    分析用のjsonデータを式に逆コンパイルする
+
+    # libclang の Index（CXIndex）はインスタンス間で 1つを共有する
+    _shared_index = None
+    # _locate_libclang の結果（見つかったパスのみ保持。見つからなければ次回また探す）
+    _cached_libclang = None
+
     def __init__(self, src_file=None, compile_args=None, check_list=None):
         # check_list は 1行のみ(int)を想定（None の場合は全行）
         try:
@@ -19,27 +80,58 @@ class CodeAnalyzer:
             self.check_list = None
 
         self.src_file = src_file
+        # 絶対パスは何度も比較に使うので 1回だけ計算しておく
+        self._src_abs = os.path.abspath(src_file) if src_file else None
+        # path -> abspath（libclang が返すファイル名は同じものが大量に出るので、この analyzer の間メモする）
+        self._abs_cache = {}
+        # 実ファイルの絶対パス -> 行のリスト（_read_src_line 用。この analyzer の間だけ持つ）
+        self._src_lines = {}
+        self._pre_abs = None
         self.compile_args = compile_args or ["-std=c11", "-Iinclude"]
-        self.preprocessed = None
+        self.preprocessed = None  # プリプロセス後の仮想ファイル名（ディスクには書かない）
+        self._pre_text = ""       # プリプロセス後テキスト（clang -E の stdout）
+        self._pre_lines = None
         self.preproc_map = {}
         self.index = None
-        # libclang を探して設定し、Index を作成する
-        lib = self._locate_libclang()
-        if lib:
-            try:
-                cindex.Config.set_library_file(lib)
-            except Exception:
-                pass
-        else:
-            sys.stderr.write("libclang not found. Set LIBCLANG_PATH or install llvm (Homebrew).\n")
-            raise RuntimeError("libclang not found")
-        self.index = cindex.Index.create()
+        # TU のキーごとのロック（_load_tu で _TU_KEY_LOCKS のものに差し替える）
+        self._tu_lock = threading.RLock()
+        # cursor.hash -> (cursor, token list) / extent -> token list（get_tokens は呼ぶたびに lex し直すのでキャッシュする。
+        # TU 単位で共有。_load_tu で設定）
+        self._tok_cache = {}
+        # ファイル名 -> ([範囲の開始オフセット, ...], [[終了オフセット, token list, 各 token の開始オフセット], ...])
+        # 一度 tokenize した範囲に含まれる cursor は、その token 列を切り出して使う（TU 単位で共有）
+        self._tok_spans = {}
+        # all_AST で AST から作る表（TU 単位で共有。_load_tu で設定）
+        #   "macroTable": TU 直下の MACRO_DEFINITION から作るマクロ表
+        #   "line_index": TU 直下の cursor の hash -> (その cursor, {実ソースの行番号: [その行のノード（preorder 順）]})
+        #   "macro_index": macroTable の名前 -> エントリの索引（_macro_index）
+        #   "tok_meta":   id(token) -> (token, spelling, begin 列, end 列)（_token_meta）
+        self._ast_cache = {}
+        # cursor.hash -> (cursor, _get_real_location の結果)（TU 単位で共有。_load_tu で設定）
+        self._loc_cache = {}
+        # libclang を探して設定し、Index を作成する（プロセス内で最初の 1回だけ。別スレッドと二重に初期化しないようロックを取る）
+        if CodeAnalyzer._shared_index is None:
+            with _INDEX_LOCK:
+                if CodeAnalyzer._shared_index is None:
+                    lib = self._locate_libclang()
+                    if lib:
+                        # set_library_file はライブラリ読み込み後に呼ぶと例外になるので、未読み込みのときだけ呼ぶ
+                        if not getattr(cindex.Config, "loaded", False):
+                            try:
+                                cindex.Config.set_library_file(lib)
+                            except Exception:
+                                pass
+                    else:
+                        sys.stderr.write("libclang not found. Set LIBCLANG_PATH or install llvm (Homebrew).\n")
+                        raise RuntimeError("libclang not found")
+                    CodeAnalyzer._shared_index = cindex.Index.create()
+        self.index = CodeAnalyzer._shared_index
         try:
-            # プリプロセスとマッピング構築
-            self.preprocessed = self._preprocess_file(self.src_file, self.compile_args)
-            self.preproc_map = self._build_preprocessed_line_map(self.preprocessed)
+            # プリプロセスとマッピング構築（同じソース/引数/内容なら clang -E を再実行しない）
+            self.preprocessed, self._pre_text, self.preproc_map = self._load_preprocessed(self.src_file, self.compile_args)
 
-            self.tu = self.index.parse(self.preprocessed, args=[], options=cindex.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD)
+            self._pre_abs = os.path.abspath(self.preprocessed)
+            self.tu = self._load_tu()
         except Exception:
             sys.stderr.write("parse fault\n")
             raise RuntimeError("parse error")
@@ -52,43 +144,207 @@ class CodeAnalyzer:
 
     def getTu(self):
         return self.tu
+
+    def getTuLock(self):
+        # 同じ TU を使う CodeAnalyzer 間で共有するロック（all_AST の戻り値の cursor を別スレッドで使うときに持つ）
+        return self._tu_lock
     
+    def _load_tu(self):
+        """
+        プリプロセス結果（メモリ上）を unsaved_files で libclang に渡して TU を得る。
+        _TU_CACHE にあれば再利用し、テキストが変わっていれば新しく parse してキャッシュを差し替える。
+        キーのロックは self._tu_lock に持っておき、all_AST でも使う。
+        """
+        tu_key = (self.preprocessed, tuple(self.compile_args))
+        with _TU_CACHE_LOCK:
+            key_lock = _TU_KEY_LOCKS.get(tu_key)
+            if key_lock is None:
+                key_lock = _TU_KEY_LOCKS[tu_key] = threading.RLock()
+        self._tu_lock = key_lock
+        with key_lock:
+            return self._load_tu_locked(tu_key)
+
+    def _load_tu_locked(self, tu_key):
+        """_load_tu の本体（tu_key のロックを取った状態で呼ぶ）。"""
+        unsaved = [(self.preprocessed, self._pre_text)]
+        cached = _TU_CACHE.get(tu_key)
+        if cached:
+            text, tu, loc_cache, tok_cache, tok_spans, ast_cache = cached
+            if text is self._pre_text or text == self._pre_text:
+                self._loc_cache = loc_cache
+                self._tok_cache = tok_cache
+                self._tok_spans = tok_spans
+                self._ast_cache = ast_cache
+                return tu
+            # テキストが変わった場合、キャッシュの TU を reparse すると、それを持っている
+            # 既存の CodeAnalyzer の cursor やキャッシュが別のテキストを指してしまうので、新しく parse する
+        tu = self.index.parse(
+            self.preprocessed,
+            args=[],
+            unsaved_files=unsaved,
+            options=cindex.TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD,
+        )
+        _TU_CACHE[tu_key] = (self._pre_text, tu, self._loc_cache, self._tok_cache, self._tok_spans, self._ast_cache)
+        return tu
+
+    @classmethod
+    def preload(cls, src_files, compile_args=None, workers=None):
+        """
+        複数ソースの clang -E とマッピング構築を先にまとめて実行し、キャッシュを温める。
+        時間の大半は clang -E の子プロセス待ち（GIL を離す）なのでスレッドで並列化する。
+        Cursor/TU は pickle できずプロセス間で渡せないため ProcessPool は使わない。
+        """
+        args = compile_args or ["-std=c11", "-Iinclude"]
+        srcs = list(dict.fromkeys(src_files or []))
+        if not srcs:
+            return
+        if len(srcs) == 1:
+            cls._load_preprocessed(srcs[0], args)
+            return
+        with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4)) as ex:
+            for fut in [ex.submit(cls._load_preprocessed, src, args) for src in srcs]:
+                try:
+                    fut.result()
+                except Exception as e:
+                    # 失敗したファイルは __init__ 側で改めて実行・エラー報告させる
+                    sys.stderr.write(f"preload failed: {e}\n")
+
         # --- プリプロセス / マッピング ---
-    def _preprocess_file(self, src_path, extra_args):
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(src_path)[1])
-        tmp.close()
-        cmd = ['clang', '-E', src_path, '-o', tmp.name] + (extra_args or [])
-        subprocess.check_call(cmd)
-        return tmp.name
-
-    def _build_preprocessed_line_map(self, pre_path):
-        mapping = {}
-        last_directive_pre = None
-        last_directive_orig = 0
-        last_directive_file = pre_path
+    @classmethod
+    def _load_preprocessed(cls, src_path, extra_args):
+        """(仮想パス, プリプロセス後テキスト, preproc_map) をキャッシュ経由で返す。"""
+        key = cls._preprocess_key(src_path, extra_args)
+        entry = _PREPROCESS_CACHE.get(key[0])
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        # 別プロセスで同じ内容を clang -E 済みならディスクから読む（line map は作り直しても軽い）
+        disk = cls._load_disk_cache(key)
+        if disk:
+            pre_path, pre_text = disk
+            cached = (pre_path, pre_text, cls._build_preprocessed_line_map(pre_path, pre_text))
+        else:
+            pre_path, pre_text = cls._preprocess_file(src_path, extra_args)
+            cached = (pre_path, pre_text, cls._build_preprocessed_line_map(pre_path, pre_text))
+            cls._save_disk_cache(key, pre_path, pre_text, cached[2])
+        _PREPROCESS_CACHE[key[0]] = (key, cached)
+        return cached
+
+    @classmethod
+    def _disk_cache_path(cls, key):
+        if not _DISK_CACHE_DIR:
+            return None
+        # clang が入れ替わると出力も変わるので、バージョン文字列もキーに含める
+        disk_key = (key, _clang_version())
+        return os.path.join(_DISK_CACHE_DIR, hashlib.sha1(repr(disk_key).encode("utf-8")).hexdigest() + ".json")
+
+    @classmethod
+    def _load_disk_cache(cls, key):
+        """
+        ディスクキャッシュから (仮想パス, プリプロセス後テキスト) を返す。無い/古い場合は None。
+        キーはソースの内容・引数・カレントディレクトリ・include 系の環境変数・clang のバージョンなので、
+        取り込んだヘッダ（linemarker に出てくるファイル）の (mtime, size) が保存時と変わっていたら使わない。
+        ※ include パス上に新しく置かれたヘッダが既存のヘッダを隠す場合は検出できない。
+        """
+        path = cls._disk_cache_path(key)
+        if not path:
+            return None
         try:
-            with open(pre_path, 'r', errors='ignore') as f:
-                for pre_ln, line in enumerate(f, 1):
-                    s = line.lstrip()
-                    m = re.match(r'#\s*(\d+)\s+"([^"]+)"', s)
-                    if m:
-                        last_directive_pre = pre_ln
-                        last_directive_orig = int(m.group(1))
-                        last_directive_file = m.group(2)
-
-                        # 変更: directive 行も「元ファイル/元行」に寄せる
-                        mapping[pre_ln] = (last_directive_file, last_directive_orig)
-                    else:
-                        if last_directive_pre is not None and pre_ln > last_directive_pre:
-                            orig_ln = last_directive_orig + (pre_ln - last_directive_pre - 1)
-                            mapping[pre_ln] = (last_directive_file, orig_ln)
-                        else:
-                            mapping[pre_ln] = (pre_path, pre_ln)
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for dep, mtime_ns, size in data["deps"]:
+                st = os.stat(dep)
+                if st.st_mtime_ns != mtime_ns or st.st_size != size:
+                    return None
+            return sys.intern(data["pre_path"]), data["text"]
+        except Exception:
+            return None
+
+    @classmethod
+    def _save_disk_cache(cls, key, pre_path, pre_text, mapping):
+        """clang -E の結果と、取り込んだファイルの (mtime, size) をディスクキャッシュに書く。失敗しても無視する。"""
+        path = cls._disk_cache_path(key)
+        if not path:
+            return
+        tmp_path = None
+        try:
+            deps = []
+            for dep in mapping.files():
+                # <built-in> / <command line> などは実ファイルではないので検証対象にしない
+                if dep.startswith("<") or not os.path.isfile(dep):
+                    continue
+                st = os.stat(dep)
+                deps.append([os.path.abspath(dep), st.st_mtime_ns, st.st_size])
+            os.makedirs(_DISK_CACHE_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=_DISK_CACHE_DIR, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"pre_path": pre_path, "deps": deps, "text": pre_text}, f)
+            os.replace(tmp_path, path)
+            tmp_path = None
         except Exception:
-            return {}
+            pass
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except Exception:
+                    pass
+
+    @classmethod
+    def _preprocess_key(cls, src_path, extra_args):
+        # 更新時刻ではなく内容で判定する（同じ内容で書き戻されただけなら clang -E をやり直さない）
+        with open(src_path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        # 相対パスの -I はカレントディレクトリで、CPATH などは環境変数で探し先が変わるのでキーに含める
+        env = tuple(os.environ.get(name, "") for name in _PREPROCESS_ENV_VARS)
+        return (os.path.abspath(src_path), tuple(extra_args or []), digest, os.getcwd(), env)
+
+    @classmethod
+    def _preprocess_file(cls, src_path, extra_args):
+        """
+        clang -E の出力を一時ファイルに書かず stdout から受け取る。
+        戻り値: (仮想ファイル名, プリプロセス後テキスト)
+        """
+        cmd = ['clang', '-E', src_path] + (extra_args or [])
+        res = subprocess.run(cmd, stdout=subprocess.PIPE, check=True, text=True, errors='ignore')
+        root, ext = os.path.splitext(os.path.abspath(src_path))
+        # libclang が返すファイル名と何度も比較するので intern しておく
+        return sys.intern(root + ".pre" + ext), res.stdout
+
+    @classmethod
+    def _build_preprocessed_line_map(cls, pre_path, pre_text=None):
+        """
+        プリプロセス後の行 -> 元ファイル/元行 の対応表を作る。
+        全行分の dict ではなく linemarker だけを持つ PreprocLineMap を返す（get() は従来どおり）。
+        """
+        try:
+            if pre_text is None:
+                with open(pre_path, 'r', errors='ignore') as f:
+                    pre_text = f.read()
+            # splitlines() は \f なども改行扱いするので clang の行番号とずれる。'\n' だけで数える
+            mapping = PreprocLineMap(pre_path, pre_text.count('\n') + 1)
+            # 行ごとに分割して調べず、linemarker だけをテキスト全体から拾う。
+            # 行番号は直前の linemarker からの改行数で進める
+            pre_ln = 1
+            pos = 0
+            for m in _LINE_DIRECTIVE_SCAN_RE.finditer(pre_text):
+                start = m.start()
+                pre_ln += pre_text.count('\n', pos, start)
+                pos = start
+                # 変更: directive 行も「元ファイル/元行」に寄せる
+                # 同じヘッダ名が linemarker ごとに繰り返し出るので intern して 1つにまとめる
+                mapping.add_directive(pre_ln, sys.intern(m.group(2)), int(m.group(1)))
+        except Exception:
+            return PreprocLineMap(pre_path, 0)
         return mapping
 
-    def _locate_libclang(self):
+    @classmethod
+    def _locate_libclang(cls):
+        if cls._cached_libclang is None:
+            cls._cached_libclang = cls._search_libclang()
+        return cls._cached_libclang
+
+    @staticmethod
+    def _search_libclang():
         env_path = os.environ.get("LIBCLANG_PATH")
         if env_path and os.path.isfile(env_path):
             return env_path
@@ -121,13 +377,43 @@ class CodeAnalyzer:
         ')', '(', ';', ',', '+', '-', '*', '/', '%', '&', '|', '^', '!', '~',
         '<', '>', '=', '?', ':', '[', ']', '{', '}'
     ])
+    # _DELIMS のどれか 1文字（区切りまでの読み飛ばしを 1文字ずつの in 判定ではなく search 1回で行う）
+    _DELIM_RE = re.compile("[" + "".join(re.escape(c) for c in sorted(_DELIMS)) + "]")
+    # 識別子の 2文字目以降（\w は str.isalnum() または '_' と同じ）
+    _IDENT_CONT_RE = re.compile(r"\w*")
+    # 単語（識別子の候補）1個分
+    _WORD_RUN_RE = re.compile(r"\w+")
+
+    def _skip_to_delim(self, s: str, k: int) -> int:
+        """s[k:] で最初の区切り文字の位置を返す（無ければ len(s)）。"""
+        m = self._DELIM_RE.search(s, k)
+        return m.start() if m else len(s)
+
+    def _abspath(self, path: str) -> str:
+        """os.path.abspath を _abs_cache でメモして返す。"""
+        a = self._abs_cache.get(path)
+        if a is None:
+            a = self._abs_cache[path] = os.path.abspath(path)
+        return a
 
     def _read_src_line(self, path: str, line_no: int) -> str:
+        # プリプロセス後の仮想ファイルはディスクに無いのでメモリ上のテキストから返す
+        if path and self.preprocessed and (path == self.preprocessed or self._abspath(path) == self._pre_abs):
+            if self._pre_lines is None:
+                self._pre_lines = self._pre_text.split("\n")
+            if 1 <= line_no <= len(self._pre_lines):
+                return self._pre_lines[line_no - 1]
+            return ""
+        # 実ファイルは呼ぶたびに先頭から読まず、この analyzer の間は行のリストを持って引く。
+        # （プロセス全体では持たない。修正で同じサイズのまま書き換わっても、次の analyzer は読み直す）
         try:
-            with open(path, "r", errors="ignore") as f:
-                for i, line in enumerate(f, 1):
-                    if i == line_no:
-                        return line.rstrip("\n")
+            abs_path = self._abspath(path)
+            lines = self._src_lines.get(abs_path)
+            if lines is None:
+                with open(abs_path, "r", errors="ignore") as f:
+                    lines = self._src_lines[abs_path] = f.read().split("\n")
+            if 1 <= line_no <= len(lines):
+                return lines[line_no - 1]
         except Exception:
             pass
         return ""
@@ -136,16 +422,33 @@ class CodeAnalyzer:
         """
         cursor.location はプリプロセス後ファイルを指すことがある。
         preproc_map を使って「実ソース側 (file,line)」に寄せる。
+        結果は cursor.hash 単位でメモする（all_AST は同じ TU を何度も全走査するため）。
+        cursor.hash は衝突しうるので (cursor, 結果) を持ち、== で同じ cursor か確かめてから使う。
         """
+        try:
+            key = cursor.hash
+        except Exception:
+            key = None
+        if key is not None:
+            hit = self._loc_cache.get(key)
+            if hit is not None and hit[0] == cursor:
+                return hit[1]
+        res = self._compute_real_location(cursor)
+        if key is not None:
+            self._loc_cache[key] = (cursor, res)
+        return res
+
+    def _compute_real_location(self, cursor):
         try:
             loc = cursor.location
             if not loc or not loc.file:
                 return None, None, None
-            file_path = str(loc.file)
+            file_path = sys.intern(str(loc.file))
             line_no = int(loc.line)
             col_no = int(loc.column)
             # プリプロセス一時ファイルなら preproc_map で実ソースへ
-            if self.preprocessed and os.path.abspath(file_path) == os.path.abspath(self.preprocessed):
+            # libclang は parse に渡したパスをそのまま返すので、まず文字列一致で判定する
+            if self.preprocessed and (file_path == self.preprocessed or self._abspath(file_path) == self._pre_abs):
                 mapped = self.preproc_map.get(line_no)
                 if mapped:
                     # col はそのまま（厳密な列変換は困難なので tokenize で補正する方針）
@@ -154,20 +457,122 @@ class CodeAnalyzer:
         except Exception:
             return None, None, None
 
+    @staticmethod
+    def _extent_key(cursor):
+        """cursor の extent を (ファイル, 開始オフセット, 終了オフセット) で返す。取れなければ None。"""
+        try:
+            start = cursor.extent.start
+            end = cursor.extent.end
+            # <built-in> など別バッファの cursor とオフセットが衝突しないようファイル名も含める
+            if start.file:
+                return (sys.intern(str(start.file)), start.offset, end.offset)
+        except Exception:
+            pass
+        return None
+
     def _safe_tokenize(self, cursor):
         """
         仕様A/B/D: tokenize 必須。失敗時は空。
+        all_AST / func_walk / getTargetInfo で同じ cursor を何度も tokenize するので、
+        cursor.hash 単位で結果を使い回す。
+        cursor.hash は 32bit のハッシュで別 cursor と衝突しうるので、(cursor, token list) を持って == で確かめる。
+        暗黙キャスト等の別 cursor でも extent が同じなら token 列は同じなので、
+        hash で外れた場合は extent（ファイル, 開始/終了オフセット）でも引く。
         """
         try:
-            return list(cursor.get_tokens())
+            key = cursor.hash
         except Exception:
-            return []
+            key = None
+        if key is not None:
+            hit = self._tok_cache.get(key)
+            if hit is not None and hit[0] == cursor:
+                return hit[1]
+        ext_key = self._extent_key(cursor)
+        toks = self._tok_cache.get(ext_key) if ext_key is not None else None
+        if toks is None and ext_key is not None:
+            # 親の式などで tokenize 済みの範囲に含まれていれば、lex し直さずに切り出す
+            toks = self._slice_tokenized_span(*ext_key)
+        if toks is None:
+            try:
+                toks = list(cursor.get_tokens())
+            except Exception:
+                toks = []
+            if ext_key is not None and toks:
+                self._add_tokenized_span(ext_key[0], ext_key[1], ext_key[2], toks)
+        if ext_key is not None:
+            self._tok_cache[ext_key] = toks
+        if key is not None:
+            self._tok_cache[key] = (cursor, toks)
+        return toks
+
+    def _add_tokenized_span(self, fname, start_off, end_off, toks):
+        """tokenize した範囲を _tok_spans に登録する（開始オフセット順）。"""
+        if start_off >= end_off:
+            return
+        starts, entries = self._tok_spans.setdefault(fname, ([], []))
+        i = bisect_right(starts, start_off)
+        starts.insert(i, start_off)
+        # 各 token の開始オフセットは切り出しに使うときまで計算しない
+        entries.insert(i, [end_off, toks, None])
+
+    def _slice_tokenized_span(self, fname, start_off, end_off):
+        """
+        [start_off, end_off) を含む tokenize 済みの範囲があれば、その token 列から
+        開始オフセットが範囲内のものを切り出して返す（clang_tokenize と同じ結果）。なければ None。
+        """
+        spans = self._tok_spans.get(fname)
+        if not spans or start_off >= end_off:
+            return None
+        starts, entries = spans
+        i = bisect_right(starts, start_off) - 1
+        if i < 0:
+            return None
+        entry = entries[i]
+        if entry[0] < end_off:
+            return None
+        offs = entry[2]
+        if offs is None:
+            try:
+                offs = [t.extent.start.offset for t in entry[1]]
+            except Exception:
+                offs = []
+            entry[2] = offs
+        if len(offs) != len(entry[1]):
+            return None
+        lo = bisect_left(offs, start_off)
+        hi = bisect_left(offs, end_off, lo)
+        if lo >= hi:
+            return None
+        return entry[1][lo:hi]
+
+    def _token_meta(self, tok):
+        """
+        token の (spelling, begin 列, end 列) を返す。
+        spelling / extent は呼ぶたびに libclang に問い合わせるので、token ごとに 1回だけ取って TU 単位でメモする。
+        （token 自体もメモに持たせて、id が別の token に再利用されないようにする）
+        """
+        meta_cache = self._ast_cache.get("tok_meta")
+        if meta_cache is None:
+            meta_cache = self._ast_cache["tok_meta"] = {}
+        meta = meta_cache.get(id(tok))
+        if meta is None or meta[0] is not tok:
+            try:
+                sp = tok.spelling
+            except Exception:
+                sp = None
+            b, e = self._compute_token_cols(tok)
+            meta = meta_cache[id(tok)] = (tok, sp, b, e)
+        return meta[1], meta[2], meta[3]
 
     def _token_cols(self, tok):
         """
         token の begin/end 列(1始まり)を返す。
         clang token は end が取れない場合があるので spelling 長で推定する。
         """
+        _, b, e = self._token_meta(tok)
+        return b, e
+
+    def _compute_token_cols(self, tok):
         try:
             b = tok.extent.start.column
         except Exception:
@@ -216,16 +621,14 @@ class CodeAnalyzer:
             return ""
         i = max(col_1based - 1, 0)
         n = len(line)
-        while i < n and line[i] in [' ', '\t']:
+        while i < n and line[i] in (' ', '\t'):
             i += 1
         if i >= n:
             return ""
         # identifier: [A-Za-z_][A-Za-z0-9_]*
         if not (line[i].isalpha() or line[i] == "_"):
             return ""
-        j = i + 1
-        while j < n and (line[j].isalnum() or line[j] == "_"):
-            j += 1
+        j = self._IDENT_CONT_RE.match(line, i + 1).end()
         return line[i:j]
 
     # --- macro table ------------------------------------------------------
@@ -294,6 +697,28 @@ class CodeAnalyzer:
 
     # --- makeLineMacroData (pre/post) ------------------------------------
 
+    def _macro_index(self, macroTable: list):
+        """
+        macroTable の名前の索引 (first, last) を返す。
+        first: 名前 -> 最初に現れたエントリ / last: 名前 -> 最後に現れたエントリ
+        識別子ごとに macroTable を線形に探さないよう、同じ macroTable に対しては TU 単位で使い回す。
+        （同名の再定義があるので、元の「先頭から探す」「dict 化で後勝ち」の両方の結果を持つ）
+        """
+        table = macroTable or []
+        cached = self._ast_cache.get("macro_index")
+        if cached is not None and cached[0] is table and cached[1] == len(table):
+            return cached[2], cached[3]
+        first = {}
+        last = {}
+        for m in table:
+            name = m.get("name")
+            if not name:
+                continue
+            first.setdefault(name, m)
+            last[name] = m
+        self._ast_cache["macro_index"] = (table, len(table), first, last)
+        return first, last
+
     def makeLineMacroData(self, pre_line: str, post_line: str, macroTable: list):
         """
         仕様: postベースの展開領域 (post_col_start/end: 1始まり) を返す。
@@ -303,8 +728,8 @@ class CodeAnalyzer:
         pre_col = 0
         post_col = 0
 
-        # lookup
-        macro_by_name = {m.get("name"): m for m in (macroTable or [])}
+        # lookup（同名があれば後勝ち）
+        _, macro_by_name = self._macro_index(macroTable)
 
         try:
             while pre_col < len(pre_line) and post_col < len(post_line):
@@ -315,8 +740,7 @@ class CodeAnalyzer:
 
                 # 不一致: pre_line から macro 名抽出（区切りまで）
                 start = pre_col
-                while pre_col < len(pre_line) and pre_line[pre_col] not in self._DELIMS:
-                    pre_col += 1
+                pre_col = self._skip_to_delim(pre_line, pre_col)
                 target_macro = pre_line[start:pre_col]
                 if not target_macro or target_macro not in macro_by_name:
                     # 仕様: try/catchで握って終了してよい
@@ -337,9 +761,7 @@ class CodeAnalyzer:
                             post_col = end0
                         else:
                             # 見つからない場合は次の区切りまで
-                            k = post_col
-                            while k < len(post_line) and post_line[k] not in self._DELIMS:
-                                k += 1
+                            k = self._skip_to_delim(post_line, post_col)
                             r_data["post_col_end"] = k
                             post_col = max(k - 1, post_col)
                     else:
@@ -366,9 +788,7 @@ class CodeAnalyzer:
                             r_data["post_col_end"] = min(len(post_line), post_col + 1)
                     else:
                         # '(' が無い: 次の区切りまで
-                        k2 = post_col
-                        while k2 < len(post_line) and post_line[k2] not in self._DELIMS:
-                            k2 += 1
+                        k2 = self._skip_to_delim(post_line, post_col)
                         r_data["post_col_end"] = k2
                         post_col = max(k2 - 1, post_col)
 
@@ -390,51 +810,47 @@ class CodeAnalyzer:
         results = []
         if not pre_line:
             return results
-        names = [m.get("name") for m in (macroTable or []) if m.get("name")]
-        if not names:
+        macro_first, _ = self._macro_index(macroTable)
+        if not macro_first:
             return results
 
         # identifier を走査して macro name が出たら範囲を確定
-        i = 0
+        # 単語（\w の連続）を正規表現でまとめて切り出し、識別子は英字か '_' から始める（"1abc" なら "abc"）
         n = len(pre_line)
-        while i < n:
-            ch = pre_line[i]
-            if ch.isalpha() or ch == "_":
-                j = i + 1
-                while j < n and (pre_line[j].isalnum() or pre_line[j] == "_"):
-                    j += 1
-                ident = pre_line[i:j]
-                if ident in names:
-                    # object macro: ident 範囲
-                    pre_start = i + 1
-                    pre_end = j
-                    # function macro: ident 〜 対応する ) まで
-                    m = next((x for x in macroTable if x.get("name") == ident), None)
-                    if m and int(m.get("kind", 0)) == 1:
-                        k = j
-                        while k < n and pre_line[k] in [' ', '\t']:
-                            k += 1
-                        if k < n and pre_line[k] == "(":
-                            depth = 0
-                            while k < n:
-                                if pre_line[k] == "(":
-                                    depth += 1
-                                elif pre_line[k] == ")":
-                                    depth -= 1
-                                    if depth == 0:
-                                        pre_end = k + 1
-                                        break
-                                k += 1
-                        else:
-                            # '(' 無し: 次の区切りまで
-                            k2 = j
-                            while k2 < n and pre_line[k2] not in self._DELIMS:
-                                k2 += 1
-                            pre_end = k2
-                    results.append({"macro_name": ident, "pre_col_start": pre_start, "pre_col_end": pre_end})
-                i = j
-            else:
+        for mo in self._WORD_RUN_RE.finditer(pre_line):
+            i, j = mo.span()
+            while i < j and not (pre_line[i].isalpha() or pre_line[i] == "_"):
                 i += 1
+            if i == j:
+                continue
+            ident = pre_line[i:j]
+            m = macro_first.get(ident)
+            if m is None:
+                continue
+            # object macro: ident 範囲
+            pre_start = i + 1
+            pre_end = j
+            # function macro: ident 〜 対応する ) まで
+            if int(m.get("kind", 0)) == 1:
+                k = j
+                while k < n and pre_line[k] in [' ', '\t']:
+                    k += 1
+                if k < n and pre_line[k] == "(":
+                    depth = 0
+                    while k < n:
+                        if pre_line[k] == "(":
+                            depth += 1
+                        elif pre_line[k] == ")":
+                            depth -= 1
+                            if depth == 0:
+                                pre_end = k + 1
+                                break
+                        k += 1
+                else:
+                    # '(' 無し: 次の区切りまで
+                    k2 = self._skip_to_delim(pre_line, j)
+                    pre_end = k2
+            results.append({"macro_name": ident, "pre_col_start": pre_start, "pre_col_end": pre_end})
         return results
 
     def _is_in_macro_region_pre(self, operator_col: int, macroLineData_pre: list) -> bool:
@@ -452,10 +868,28 @@ class CodeAnalyzer:
         """
         CodeAnalyzer.md: all_AST
         TU の子を走査して macroTable を構築し、対象行 child に対し func_walk を呼ぶ。
+        TU と共有キャッシュは同じソースの CodeAnalyzer 間で共有されるので、解析中は TU のキーのロックを持つ。
+        （戻り値の cursor も共有の TU を指すので、複数スレッドで使う場合は呼び出し側で getTuLock() のロックを持つこと）
+        """
+        with self._tu_lock:
+            try:
+                return self._all_AST(analyzeInfo)
+            finally:
+                self._flush_dbg()
+
+    def run_batch(self, analyzeInfos) -> list:
         """
+        複数の analyzeInfo を順に all_AST して、結果を同じ並びのリストで返す。
+        同じ TU のマクロ表・行ごとのノード表・token キャッシュを使い回すので、
+        行ごとに CodeAnalyzer を作り直すより速い。
+        結果には Cursor が入っていてプロセス間で渡せないため、ProcessPool では並列化しない。
+        """
+        return [self.all_AST(info) for info in (analyzeInfos or [])]
+
+    def _all_AST(self, analyzeInfo: dict) -> dict:
         line = int(analyzeInfo.get("line", 0) or 0)
         pre_line = self._read_src_line(self.src_file, line)
-        src_abs = os.path.abspath(self.src_file) if self.src_file else None
+        src_abs = self._src_abs
 
         self._dbg("all_AST enter", f"line={line}", f"src={self.src_file}", f"src_abs={src_abs}", f"pre_line={pre_line!r}")
         self._dbg("analyzeInfo", analyzeInfo)
@@ -476,55 +910,114 @@ class CodeAnalyzer:
         if tu is None:
             return _empty()
 
-        # まず macroTable は TU直下から集める（量が多いのでここは従来のまま）
-        macroTable = []
         try:
-            for child in tu.cursor.get_children():
-                try:
-                    if child.kind == cindex.CursorKind.MACRO_DEFINITION:
-                        m = self._parse_macro_definition(child)
-                        if m:
-                            macroTable.append(m)
-                            if len(macroTable) <= 10:
-                                self._dbg("macro add", m.get("name"), "kind", m.get("kind"))
-                except Exception:
-                    pass
+            top_level = list(tu.cursor.get_children())
         except Exception:
-            pass
+            top_level = []
+
+        # まず macroTable は TU直下から集める（量が多いので TU ごとに 1回だけ作って使い回す）
+        macroTable = self._ast_cache.get("macroTable")
+        if macroTable is None:
+            macroTable = []
+            try:
+                for child in top_level:
+                    try:
+                        if child.kind == cindex.CursorKind.MACRO_DEFINITION:
+                            m = self._parse_macro_definition(child)
+                            if m:
+                                macroTable.append(m)
+                                if len(macroTable) <= 10:
+                                    self._dbg("macro add", m.get("name"), "kind", m.get("kind"))
+                    except Exception:
+                        pass
+            except Exception:
+                pass
+            self._ast_cache["macroTable"] = macroTable
+        else:
+            self._dbg("macroTable cached", f"size={len(macroTable)}")
 
         # 重要: TU全体を preorder で走査して、file+line 一致の「行の中のノード」を拾う
         visited = 0
         matched = 0
         picked = None
+        picked_ntok = None  # picked の token 数（2つ目の候補が出るまでは tokenize しない）
+        picked_ext = None   # picked の _extent_key（同上）
+        abs_cache = self._abs_cache  # file -> abspath（同じファイル名が大量に出るのでメモする）
 
-        try:
-            for node in tu.cursor.walk_preorder():
-                visited += 1
-
-                f, ln, col = self._get_real_location(node)
-                if ln != line:
-                    continue
+        # ヘッダ由来の宣言や対象行を含まない関数は、TU直下の範囲だけ見て丸ごと飛ばす
+        roots = [c for c in top_level if self._may_contain_line(c, line, src_abs, abs_cache)]
+        self._dbg("top-level roots", f"kept={len(roots)}", f"total={len(top_level)}")
 
-                f_abs = os.path.abspath(f) if f else None
-                if src_abs and f_abs and f_abs != src_abs:
-                    continue
-
-                # 同じ行に複数ノードがあるので、とりあえず「その行の Statement/Expr っぽいもの」を優先
-                matched += 1
-                if picked is None:
-                    picked = node
-                else:
+        # root ごとに 1回だけ走査して「行番号 -> ノード」に振り分けておき、
+        # 同じ関数の別の行を解析するときは走査せずに引く
+        line_index = self._ast_cache.setdefault("line_index", {})
+        try:
+            for root in roots:
+                try:
+                    rkey = root.hash
+                except Exception:
+                    rkey = None
+                # hash は衝突しうるので、登録した root と == で同じか確かめてから使う
+                entry = line_index.get(rkey) if rkey is not None else None
+                buckets = entry[1] if entry is not None and entry[0] == root else None
+                walk_error = None
+                if buckets is None:
+                    buckets = {}
                     try:
-                        # より内側（深い）を優先するため、token が取れる/長い方を採用
-                        a = len(self._safe_tokenize(picked))
-                        b = len(self._safe_tokenize(node))
-                        if b >= a:
-                            picked = node
-                    except Exception:
-                        pass
-
-                if matched <= 5:
-                    self._dbg_cursor("line-matched node", node)
+                        for node in self._iter_preorder([root]):
+                            visited += 1
+
+                            f, ln, col = self._get_real_location(node)
+                            if ln is None:
+                                continue
+
+                            f_abs = abs_cache.get(f)
+                            if f_abs is None and f:
+                                f_abs = abs_cache[f] = os.path.abspath(f)
+                            if src_abs and f_abs and f_abs != src_abs:
+                                continue
+                            buckets.setdefault(ln, []).append(node)
+                    except Exception as e:
+                        # 途中で失敗した root は登録しない（そこまでに拾えた分だけ使って打ち切る）
+                        walk_error = e
+                    else:
+                        if rkey is not None:
+                            line_index[rkey] = (root, buckets)
+
+                for node in buckets.get(line, ()):
+                    # 同じ行に複数ノードがあるので、とりあえず「その行の Statement/Expr っぽいもの」を優先
+                    matched += 1
+                    if picked is None:
+                        picked = node
+                        picked_ntok = None
+                        picked_ext = None
+                    else:
+                        try:
+                            # より内側（深い）を優先するため、token が取れる/長い方を採用
+                            if picked_ntok is None:
+                                picked_ntok = len(self._safe_tokenize(picked))
+                                picked_ext = self._extent_key(picked)
+                            node_ext = self._extent_key(node)
+                            if (picked_ntok > 0 and node_ext is not None and picked_ext is not None
+                                    and node_ext[0] == picked_ext[0]
+                                    and picked_ext[1] <= node_ext[1] and node_ext[2] <= picked_ext[2]):
+                                # picked の範囲内のノード（preorder なので大半がこれ）は token 列が picked の一部なので、
+                                # token 数が picked 以上になるのは範囲が同じ（= token 列も同じ）ときだけ。tokenize せずに決める
+                                if node_ext == picked_ext:
+                                    picked = node
+                            else:
+                                b = len(self._safe_tokenize(node))
+                                if b >= picked_ntok:
+                                    picked = node
+                                    picked_ntok = b
+                                    picked_ext = node_ext
+                        except Exception:
+                            pass
+
+                    if matched <= 5:
+                        self._dbg_cursor("line-matched node", node)
+                if walk_error is not None:
+                    raise walk_error
         except Exception as e:
             self._dbg("walk_preorder exception", e)
 
@@ -542,22 +1035,85 @@ class CodeAnalyzer:
             self._dbg("func_walk exception", e)
             return _empty()
 
+    def _iter_preorder(self, roots):
+        """
+        roots 以下を preorder（walk_preorder と同じ順）で返す。
+        cindex の walk_preorder は深さ分の generator を入れ子にして yield するので、
+        明示スタックで 1段の generator にする。
+        """
+        stack = list(reversed(roots))
+        while stack:
+            node = stack.pop()
+            yield node
+            try:
+                children = list(node.get_children())
+            except Exception:
+                continue
+            if children:
+                children.reverse()
+                stack.extend(children)
+
+    def _may_contain_line(self, cursor, line: int, src_abs, abs_cache: dict) -> bool:
+        """
+        TU 直下の cursor の範囲（プリプロセス後の行）を preproc_map で実ソースに戻し、
+        src_file の line を含みうるかを返す。判定できない場合は True（走査する）。
+        """
+        try:
+            ext = cursor.extent
+            start, end = ext.start, ext.end
+            if not start.file or not self.preprocessed:
+                return True
+            f = sys.intern(str(start.file))
+            if f != self.preprocessed and self._abspath(f) != self._pre_abs:
+                return True
+            ms = self.preproc_map.get(int(start.line))
+            me = self.preproc_map.get(int(end.line))
+        except Exception:
+            return True
+        if not ms or not me or not src_abs:
+            return True
+
+        def _abs(f):
+            a = abs_cache.get(f)
+            if a is None:
+                a = abs_cache[f] = os.path.abspath(f)
+            return a
+
+        s_abs, e_abs = _abs(ms[0]), _abs(me[0])
+        if s_abs == e_abs != src_abs:
+            # 始まりも終わりも別ファイル（ヘッダ）
+            return False
+        if s_abs == e_abs == src_abs:
+            return ms[1] <= line <= me[1]
+        return True
+
     # --- func_walk --------------------------------------------------------
 
     def _all_cols_in_src(self, line_str: str, token_spelling: str) -> list:
         """line_str 中の token_spelling 出現列(1-based)を昇順で返す。"""
         if not line_str or not token_spelling:
             return []
-        cols = []
-        start = 0
-        while True:
-            k = line_str.find(token_spelling, start)
-            if k < 0:
-                break
-            cols.append(k + 1)
-            # 重なり検出を避ける（例: '>>' を 1文字ずつずらして誤検出しない）
-            start = k + max(len(token_spelling), 1)
-        return cols
+        # finditer は重ならない出現だけを返す（例: '>>' を 1文字ずつずらして誤検出しない）
+        return [mo.start() + 1 for mo in CodeAnalyzer._literal_re(token_spelling).finditer(line_str)]
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _literal_re(text: str):
+        """text そのもの（正規表現としてエスケープ済み）にマッチするパターン。演算子ごとに 1回だけコンパイルする。"""
+        return re.compile(re.escape(text))
+
+    # _extract_expr_around_operator で使う演算子・区切り文字（呼び出しごとに作り直さない）
+    _EXPR_OPS_3 = frozenset({"<<=", ">>="})
+    _EXPR_OPS_2 = frozenset({
+        "==", "!=", "<=", ">=",
+        "&&", "||",
+        "<<", ">>",
+        "+=", "-=", "*=", "/=", "%=", "&=", "|=", "^=",
+        "->",
+    })
+    _EXPR_OPS_1 = frozenset("+-*/%&|^<>!=?:")
+    _EXPR_STOP_CHARS = frozenset(";,")
+    _EXPR_OPEN_CHARS = frozenset("([{")
 
     def _extract_expr_around_operator(self, line_str: str, operator_col_1based: int) -> str:
         """
@@ -572,7 +1128,14 @@ class CodeAnalyzer:
             例: f(EFGHIJK + a, b) の '+' → "EFGHIJK + a"
           - 複数文字の2項演算子 (==, <=, >=, !=, &&, ||, <<, >>, +=, -=, *=, /=, %=, &=, |=, ^=, <<=, >>= など) に対応
           - 評価順/優先順位は厳密に追わない（境界切り出しのみ）
+
+        同じ行・同じ列は候補ごとに何度も切り出されるので、結果は (行, 列) 単位でメモする。
         """
+        return CodeAnalyzer._scan_expr_around_operator(line_str, operator_col_1based)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _scan_expr_around_operator(line_str: str, operator_col_1based: int) -> str:
         if not line_str or operator_col_1based <= 0:
             return ""
 
@@ -583,19 +1146,13 @@ class CodeAnalyzer:
             return ""
 
         # --- 演算子候補（長いもの優先）---
-        OPS_3 = {"<<=", ">>="}
-        OPS_2 = {
-            "==", "!=", "<=", ">=",
-            "&&", "||",
-            "<<", ">>",
-            "+=", "-=", "*=", "/=", "%=", "&=", "|=", "^=",
-            "->",
-        }
-        OPS_1 = set(list("+-*/%&|^<>!=?:"))
+        OPS_3 = CodeAnalyzer._EXPR_OPS_3
+        OPS_2 = CodeAnalyzer._EXPR_OPS_2
+        OPS_1 = CodeAnalyzer._EXPR_OPS_1
 
-        STOP_CHARS = set(list(";,"))
+        STOP_CHARS = CodeAnalyzer._EXPR_STOP_CHARS
         ARG_SEP = ","
-        OPEN_CHARS = set(list("([{"))
+        OPEN_CHARS = CodeAnalyzer._EXPR_OPEN_CHARS
 
         def _peek_op_at(pos: int) -> str:
             """pos を先頭として演算子文字列（最大3文字）を返す。無ければ ''。"""
@@ -807,79 +1364,69 @@ class CodeAnalyzer:
         src_op_cols = self._all_cols_in_src(pre_line, target_operator)
         self._dbg("src_op_cols", src_op_cols)
 
-        candidates = []
+        # src_col が同じ候補は重複なので最初の 1件だけ残す（= pre_line 上の + 出現数と合わせる）
+        # 走査中に振り分けておき、後で sort + 重複除去の 2パスをしない
+        by_src_col = {}   # src_col -> candidate（最初に見つかったもの）
+        no_src_col = []   # src_col が None の候補（走査順のまま末尾に並べる）
+        found = 0
         seen_same_col = {}  # token列が同じ候補が複数ある場合のインデックス付け
 
-        def walk_once(cur):
-            stack = [cur]
-            visited = 0
-            while stack:
-                node = stack.pop()
-                visited += 1
-
-                try:
-                    k = node.kind
-                except Exception:
-                    k = None
-
-                is_bin = (k == cindex.CursorKind.BINARY_OPERATOR)
-                is_cas = (k == cindex.CursorKind.COMPOUND_ASSIGNMENT_OPERATOR)
+        # 再帰/クロージャを使わず 1本のスタックで走査（kind 定数はローカルに退避）
+        KIND_BIN = cindex.CursorKind.BINARY_OPERATOR
+        KIND_CAS = cindex.CursorKind.COMPOUND_ASSIGNMENT_OPERATOR
+        stack = [child] if target_operator else []  # operator 指定なしなら候補は出ない
+        visited = 0
+        while stack:
+            node = stack.pop()
+            visited += 1
 
-                if (is_bin or is_cas) and target_operator:
-                    try:
-                        if (node.spelling or "") == target_operator:
-                            self._dbg_cursor("candidate node", node)
-                            self._dbg_tokens("candidate node", node, limit=60)
-
-                            tok_col = self._get_operator_col_from_tokens(node, target_operator)
-                            self._dbg("operator_col_from_tokens", tok_col)
-
-                            if tok_col is not None:
-                                in_macro = self._is_in_macro_region_pre(tok_col, macroLineData_pre)
-                                self._dbg("in_macro_region?", in_macro)
-                                if not in_macro:
-                                    # ★ここが重要: token列が同じ候補を区別して、pre_line上のN個目の列を割り当てる
-                                    idx = seen_same_col.get(tok_col, 0)
-                                    seen_same_col[tok_col] = idx + 1
-                                    src_col = src_op_cols[idx] if idx < len(src_op_cols) else None
-
-                                    candidates.append({
-                                        "child": node,
-                                        "col": tok_col,          # 旧: 展開後列（参考）
-                                        "src_col": src_col,      # 新: 実ソース(pre_line)列（これで選ぶ）
-                                        "src_index": idx + 1,    # 1-based: 何個目の'+'
-                                    })
-                    except Exception:
-                        pass
+            try:
+                k = node.kind
+            except Exception:
+                k = None
 
+            if k == KIND_BIN or k == KIND_CAS:
                 try:
-                    stack.extend(list(node.get_children()))
+                    if (node.spelling or "") == target_operator:
+                        self._dbg_cursor("candidate node", node)
+                        self._dbg_tokens("candidate node", node, limit=60)
+
+                        tok_col = self._get_operator_col_from_tokens(node, target_operator)
+                        self._dbg("operator_col_from_tokens", tok_col)
+
+                        if tok_col is not None:
+                            in_macro = self._is_in_macro_region_pre(tok_col, macroLineData_pre)
+                            self._dbg("in_macro_region?", in_macro)
+                            if not in_macro:
+                                # ★ここが重要: token列が同じ候補を区別して、pre_line上のN個目の列を割り当てる
+                                idx = seen_same_col.get(tok_col, 0)
+                                seen_same_col[tok_col] = idx + 1
+                                src_col = src_op_cols[idx] if idx < len(src_op_cols) else None
+
+                                cand = {
+                                    "child": node,
+                                    "col": tok_col,          # 旧: 展開後列（参考）
+                                    "src_col": src_col,      # 新: 実ソース(pre_line)列（これで選ぶ）
+                                    "src_index": idx + 1,    # 1-based: 何個目の'+'
+                                }
+                                found += 1
+                                if src_col is None:
+                                    no_src_col.append(cand)
+                                elif src_col not in by_src_col:
+                                    by_src_col[src_col] = cand
                 except Exception:
                     pass
 
-            self._dbg("walk_once done", f"visited={visited}", f"candidates={len(candidates)}")
-
-        walk_once(child)
-
-        # ★ソートは src_col 優先（None は末尾）
-        candidates.sort(key=lambda x: (x.get("src_col") is None, x.get("src_col", 10**9)))
-        self._dbg("candidates sorted src_cols", [(c.get("src_col"), c.get("src_index")) for c in candidates])
+            try:
+                stack.extend(node.get_children())
+            except Exception:
+                pass
 
-        # 追加: src_col が同じ候補は重複なので 1件に絞る（= pre_line 上の + 出現数と合わせる）
-        deduped = []
-        seen_cols = set()
-        for c in candidates:
-            sc = c.get("src_col")
-            if sc is None:
-                deduped.append(c)
-                continue
-            if sc in seen_cols:
-                continue
-            seen_cols.add(sc)
-            deduped.append(c)
+        self._dbg("walk done", f"visited={visited}", f"candidates={found}")
 
-        candidates = deduped
-        self._dbg("candidates deduped src_cols", [(c.get("src_col"), c.get("src_index")) for c in candidates])
+        # ★並びは src_col 昇順（None は末尾）
+        candidates = [by_src_col[sc] for sc in sorted(by_src_col)] + no_src_col
+        self._dbg("candidates src_cols", f"found={found}", [(c.get("src_col"), c.get("src_index")) for c in candidates])
 
         if exitnum <= 0 or exitnum > len(candidates):
             self._dbg("NO TARGET", f"exitnum={exitnum}", f"len(candidates)={len(candidates)}")
@@ -909,21 +1456,18 @@ class CodeAnalyzer:
         toks = self._safe_tokenize(cursor)
         self._dbg("get_operator_col_from_tokens", f"operator={operator_spelling!r}", f"tokens={len(toks)}", f"cursor_sp={getattr(cursor,'spelling',None)!r}")
         for t in toks:
-            try:
-                if t.spelling == operator_spelling:
-                    b, _ = self._token_cols(t)
-                    return b
-            except Exception:
-                continue
+            sp, b, _ = self._token_meta(t)
+            if sp == operator_spelling:
+                return b
         return None
 
     def _guess_operator_token(self, cursor, operator_col: int) -> str:
         # token 列から operator_col の token を拾う（保険）
         toks = self._safe_tokenize(cursor)
         for t in toks:
-            b, _ = self._token_cols(t)
-            if b == operator_col:
-                return t.spelling
+            sp, b, _ = self._token_meta(t)
+            if b == operator_col and sp is not None:
+                return sp
         return getattr(cursor, "spelling", "") or ""
 
     def _decide_kind(self, node, pre_line: str, col_1based: int, macroTable: list):
@@ -937,9 +1481,9 @@ class CodeAnalyzer:
         # macro: 実ソース行から識別子切り出し
         ident = self._extract_identifier_at(pre_line, col_1based)
         if ident:
-            for m in macroTable or []:
-                if m.get("name") == ident:
-                    return "macro", [{"macro_name": m.get("name"), "macro_val": m.get("val")}]
+            m = self._macro_index(macroTable)[0].get(ident)
+            if m is not None:
+                return "macro", [{"macro_name": m.get("name"), "macro_val": m.get("val")}]
 
         return "val", None
 
@@ -958,7 +1502,7 @@ class CodeAnalyzer:
         仕様[3.3]: マクロが含まれる場合はマクロ名に戻す。
         実装は簡易: left_col/right_col 位置の先頭識別子が macro 名なら置換する。
         """
-        macro_by = {m.get("name"): m for m in (macroTable or []) if m.get("name")}
+        macro_by, _ = self._macro_index(macroTable)
         l_ident = self._extract_identifier_at(pre_line, left_col)
         r_ident = self._extract_identifier_at(pre_line, right_col)
 
@@ -1058,23 +1602,23 @@ class CodeAnalyzer:
 
         return line_str
 
+    _NO_SPACE_BEFORE = frozenset((")", "]", ",", ";"))
+    _NO_SPACE_AFTER = frozenset(("(", "[", ","))
+
     def _tokens_to_c_expr(self, toks) -> str:
         """token列をCの見た目に近い形へ整形する（最小）。"""
-        sp = [t.spelling for t in (toks or []) if getattr(t, "spelling", None) is not None]
-        if not sp:
-            return ""
+        # spelling の中間リストは作らず 1パスで組み立てる
         out = []
-        for s in sp:
-            if not out:
-                out.append(s)
+        prev = None
+        for t in (toks or []):
+            s = getattr(t, "spelling", None)
+            if s is None:
                 continue
-            prev = out[-1]
-            if s in [")", "]", ",", ";"]:
-                out.append(s)
-            elif prev in ["(", "[", ","]:
-                out.append(s)
-            else:
-                out.append(" " + s)
+            # prev は直前に追加した要素（先頭スペース込み）で判定する（従来どおり）
+            if prev is not None and s not in self._NO_SPACE_BEFORE and prev not in self._NO_SPACE_AFTER:
+                s = " " + s
+            out.append(s)
+            prev = s
         return "".join(out).strip()
 
     def _src_slice_by_cols(self, line_str: str, begin_col: int, end_col_exclusive: int) -> str:
@@ -1099,15 +1643,15 @@ class CodeAnalyzer:
         if not s:
             return s
         # 連続空白を1つに
-        s = re.sub(r"[ \t]+", " ", s)
+        s = _HSPACE_RE.sub(" ", s)
 
         # '( int )' -> '(int)'
-        s = re.sub(r"\(\s*", "(", s)
-        s = re.sub(r"\s*\)", ")", s)
+        s = _OPEN_PAREN_SPACES_RE.sub("(", s)
+        s = _CLOSE_PAREN_SPACES_RE.sub(")", s)
 
         # '(int) b' / ') b' -> '(int)b' / ')b'（識別子だけでなく数値/式の先頭も対象にする）
         # 例: ') b' ') 123' ') *p' などを最小限に詰める
-        s = re.sub(r"\)\s+([A-Za-z_0-9\*])", r")\1", s)
+        s = _CLOSE_PAREN_GAP_RE.sub(r")\1", s)
 
         return s.strip()
 
@@ -1116,8 +1660,12 @@ class CodeAnalyzer:
     # ※ 環境変数は使わない。ファイル先頭の DEBUG=1 のときだけ print。
     # ---------------------------------------------------------------------
     def _dbg(self, *args):
+        # 出力は DebugLog の共有バッファに貯まり、all_AST の最後か終了時にまとめて書き出される
         if DEBUG == 1:
-            print("[CodeAnalyzerDBG]", *args)
+            _DBG_LOG.debug(" ".join([str(a) for a in args]))
+
+    def _flush_dbg(self):
+        flushDebugLog()
 
     def _dbg_cursor(self, label: str, cursor):
         if DEBUG != 1:
@@ -1142,11 +1690,11 @@ class CodeAnalyzer:
         toks = self._safe_tokenize(cursor)
         parts = []
         for t in toks[:limit]:
-            try:
-                b, e = self._token_cols(t)
-                parts.append(f"{t.spelling}@{b}-{e}")
-            except Exception:
+            sp, b, e = self._token_meta(t)
+            if sp is None:
                 parts.append(f"{getattr(t,'spelling',None)}@?")
+            else:
+                parts.append(f"{sp}@{b}-{e}")
         self._dbg(f"{label}: tokens({len(toks)}): " + " ".join(parts) + ("" if len(toks) <= limit else " ..."))
 
     # 追加: pre_line（マクロ含む実ソース）上での token 位置検索
@@ -1184,18 +1732,18 @@ class CodeAnalyzer:
         """
         if not name or not macroTable:
             return None
-        for m in macroTable:
-            try:
-                if m.get("name") == name:
-                    v = m.get("val", None)
-                    if v is None:
-                        v = m.get("value", None) or m.get("expansion", None) or m.get("body", None) or m.get("spelling", None)
-                    if v is None:
-                        return ""
-                    return str(v).strip()
-            except Exception:
-                continue
-        return None
+        m = self._macro_index(macroTable)[0].get(name)
+        if m is None:
+            return None
+        try:
+            v = m.get("val", None)
+            if v is None:
+                v = m.get("value", None) or m.get("expansion", None) or m.get("body", None) or m.get("spelling", None)
+            if v is None:
+                return ""
+            return str(v).strip()
+        except Exception:
+            return None
 
     # 置換: 「代入の rhs を丸ごと @1」にしていたのが誤り。
     # 要求どおり「rhs の中で target_expr だけを @1 に置換」する。
@@ -1228,8 +1776,8 @@ class CodeAnalyzer:
             # 3) 空白正規化なしでは見つからないケース向けに、
             #    target_expr の空白を潰した版で再探索（軽いフォールバック）
             try:
-                s2 = re.sub(r"[ \t]+", "", s)
-                t2 = re.sub(r"[ \t]+", "", target_expr)
+                s2 = _HSPACE_RE.sub("", s)
+                t2 = _HSPACE_RE.sub("", target_expr)
                 if t2:
                     k = s2.find(t2)
                     if k >= 0:
@@ -1250,7 +1798,7 @@ class CodeAnalyzer:
 
         lhs_raw, rhs_raw = s_strip.split("=", 1)
 
-        indent = re.match(r"^\s*", lhs_raw).group(0)
+        indent = _LEADING_SPACES_RE.match(lhs_raw).group(0)
         lhs_name = lhs_raw.strip()
         rhs_part = rhs_raw.strip()
 
@@ -1266,8 +1814,8 @@ class CodeAnalyzer:
             return f"{indent}{lhs_name} = {rhs_part}{semi}"
 
         new_rhs = rhs_part[:idx] + replacement + rhs_part[idx + len(target_expr):]
-        new_rhs = re.sub(r"\s*\+\s*", " + ", new_rhs)
-        new_rhs = re.sub(r"\s+", " ", new_rhs).strip()
+        new_rhs = _PLUS_SPACES_RE.sub(" + ", new_rhs)
+        new_rhs = _SPACES_RE.sub(" ", new_rhs).strip()
 
         r_val = f"{indent}{lhs_name} = {new_rhs}{semi}"
         self._dbg("r_val:", r_val)
@@ -1288,11 +1836,15 @@ class CodeAnalyzer:
             operator_col_hint = int(target_data.get("col", 0) or 0)
             operator_col = self._find_token_col_in_src(pre_line, op_str, near_col_1based=operator_col_hint) or operator_col_hint
 
-        children = list(cursor.get_children())
-        if len(children) < 2:
+        # 二項演算子の子は [lhs, rhs]。リストにせず先頭 2つだけ取り出す
+        try:
+            it = cursor.get_children()
+            left_node = next(it, None)
+            right_node = next(it, None)
+        except Exception:
+            return None
+        if left_node is None or right_node is None:
             return None
-        left_node = children[0]
-        right_node = children[1]
 
         # ------------------------------------------------------------------
         # A) eval_spelling_extend（= 展開前 / 元ソース）
@@ -1321,7 +1873,10 @@ class CodeAnalyzer:
             post_line = ""
 
         # 2) token列で得た op の「列」（プリプロセス後ファイル上の列）
-        op_col_tok = self._get_operator_col_from_tokens(cursor, op_str)
+        #    func_walk が同じ cursor/演算子で求めた値（target_data["col"]）があればそれを使う
+        op_col_tok = target_data.get("col")
+        if op_col_tok is None:
+            op_col_tok = self._get_operator_col_from_tokens(cursor, op_str)
 
         # 3) op_col_tok を「展開後の演算子位置」として確定させる（= 再計算）
         #    - 基本は post_line に対して op_col_tok を採用 (token column と一致する前提)
@@ -1373,7 +1928,7 @@ class CodeAnalyzer:
 
         left_val_kind = "val"
         left_kind_op = None
-        if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", left_val_spelling):
+        if _IDENT_RE.fullmatch(left_val_spelling):
             mv2 = self._lookup_object_macro_value(left_val_spelling, macroTable)
             if mv2 is not None:
                 left_val_kind = "macro"
@@ -1384,7 +1939,7 @@ class CodeAnalyzer:
 
         right_val_kind = "val"
         right_kind_op = None
-        if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", right_val_spelling):
+        if _IDENT_RE.fullmatch(right_val_spelling):
             mv2 = self._lookup_object_macro_value(right_val_spelling, macroTable)
             if mv2 is not None:
                 right_val_kind = "macro"
@@ -1396,8 +1951,6 @@ class CodeAnalyzer:
         left_col = self._find_token_col_in_src(pre_line, left_val_spelling, near_col_1based=operator_col - 1) or 1
         right_col = self._find_token_col_in_src(pre_line, right_val_spelling, near_col_1based=operator_col + 1) or (operator_col + 1)
 
-        spelling = self._replace_in_assignment_rhs(pre_line, raw_target_expr_pre, "@1")
-
         # 要件: chenge_spelling = eval_spelling_extend
         # spelling は「@1 を含む行テンプレ」にする
         spelling = self._replace_in_assignment_rhs(pre_line, raw_target_expr_pre, "@1")
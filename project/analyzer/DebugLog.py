@@ -0,0 +1,53 @@
+import logging
+import logging.handlers
+import sys
+
+# バッファがこの件数になったら書き出す
+_CAPACITY = 4096
+
+
+class _BufferedStdoutHandler(logging.handlers.MemoryHandler):
+    """
+    デバッグ出力を貯めて、flush のときに stdout へ 1回の write でまとめて書き出す。
+    （print を 1回ずつ呼ぶと行ごとに write が走るため）
+
+    logging は終了時に atexit で logging.shutdown を呼び、そこで close -> flush されるので、
+    明示的に flush しないまま終了した場合や、途中で例外になった場合も出力は失われない。
+    """
+
+    def __init__(self):
+        super().__init__(_CAPACITY, flushLevel=logging.CRITICAL + 1)
+        self.setFormatter(logging.Formatter("[%(name)s] %(message)s"))
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                # 差し替えられた stdout にも出るよう、書き出すたびに sys.stdout を見る
+                sys.stdout.write("".join([self.format(r) + "\n" for r in self.buffer]))
+                sys.stdout.flush()
+                self.buffer.clear()
+        finally:
+            self.release()
+
+
+# CodeAnalyzer / SignedTypeFixer など全モジュールで 1つを共有する（出力順を保つため）
+_handler = _BufferedStdoutHandler()
+
+
+def getDebugLogger(tag: str) -> logging.Logger:
+    """
+    tag 名のデバッグ用 logger を返す。出力は "[tag] メッセージ" の形で共有バッファに貯まる。
+    """
+    logger = logging.getLogger(tag)
+    if _handler not in logger.handlers:
+        logger.addHandler(_handler)
+    logger.setLevel(logging.DEBUG)
+    # ルート logger の設定に関係なく同じ形で出す
+    logger.propagate = False
+    return logger
+
+
+def flushDebugLog() -> None:
+    """貯まっているデバッグ出力を書き出す。"""
+    _handler.flush()
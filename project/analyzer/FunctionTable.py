@@ -24,6 +24,9 @@ class FunctionTable:
 
         rows = []
         seen = set()
+        # 比較に使う basename は関数ごとに計算し直さない
+        src_base = os.path.basename(self.src_file) if self.src_file else None
+        base_cache = {}  # orig_file -> basename
 
         def _is_in_srcfile(cur: cindex.Cursor) -> bool:
             """
@@ -38,11 +41,14 @@ class FunctionTable:
                 if not orig_file:
                     orig_file = cur.location.file.name if cur.location and cur.location.file else None
 
-                if not orig_file or not self.src_file:
+                if not orig_file or not src_base:
                     return False
 
                 # ファイル名（basename）で比較
-                return os.path.basename(orig_file) == os.path.basename(self.src_file)
+                base = base_cache.get(orig_file)
+                if base is None:
+                    base = base_cache[orig_file] = os.path.basename(orig_file)
+                return base == src_base
             except Exception:
                 return False
 
@@ -95,16 +101,24 @@ class FunctionTable:
             except Exception:
                 return
 
-        def _walk(n: cindex.Cursor):
+        def _children(n: cindex.Cursor) -> list:
             try:
-                for ch in n.get_children():
-                    if ch.kind == cindex.CursorKind.FUNCTION_DECL:
-                        _add_func(ch)
-                    _walk(ch)
+                return list(n.get_children())
             except Exception:
-                return
-
-        _walk(self.tu.cursor)
+                return []
+
+        # 再帰だと深い AST で関数呼び出しのオーバーヘッド/再帰上限に当たるので明示スタックで走査する。
+        # 子は逆順に積んで、従来の再帰と同じ preorder（=関数表の並び順）を保つ。
+        kind_func = cindex.CursorKind.FUNCTION_DECL
+        stack = _children(self.tu.cursor)[::-1]
+        while stack:
+            ch = stack.pop()
+            try:
+                if ch.kind == kind_func:
+                    _add_func(ch)
+            except Exception:
+                pass
+            stack.extend(reversed(_children(ch)))
         self.data = rows
         return self.data
 
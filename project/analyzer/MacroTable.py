@@ -1,3 +1,10 @@
+import re
+
+# よく使う正規表現はモジュール読み込み時に 1回だけコンパイルしておく
+_DEFINE_RE = re.compile(r'^\s*#\s*define\s+([A-Za-z_][A-Za-z0-9_]*)\s+(.*)$')
+_TOKEN_RE = re.compile(r'\b([A-Za-z_][A-Za-z0-9_]*)\b')
+_WORD_RE = re.compile(r'\w+')
+
 class MacroTable:
     """
     マクロ展開表（現時点では作成するが使用は保留）
@@ -9,27 +16,31 @@ class MacroTable:
         self.src_file = src_file
         self.compile_args = compile_args or ["-std=c11", "-Iinclude"]
 
-    def make(self):
+    def make(self, lines=None, line_words=None):
         # ソースを直接解析して簡易的なマクロ表を作成する
+        # lines / line_words（各行の \w+ のリスト）を渡された場合はそれを使う（SymbolTables から共有）
         macros = {}      # name -> raw value
         defines_lines = {}  # name -> line_no
-        try:
-            with open(self.src_file, 'r', encoding='utf-8', errors='ignore') as f:
-                for i, line in enumerate(f, 1):
-                    m = re.match(r'^\s*#\s*define\s+([A-Za-z_][A-Za-z0-9_]*)\s+(.*)$', line)
-                    if m:
-                        name = m.group(1)
-                        val = m.group(2).strip()
-                        macros[name] = val
-                        defines_lines[name] = i
-        except Exception:
-            return []
+        if lines is None:
+            try:
+                # ソースは 1回だけ読み、定義の収集と使用箇所の走査で使い回す
+                with open(self.src_file, 'r', encoding='utf-8', errors='ignore') as f:
+                    lines = f.readlines()
+            except Exception:
+                return []
+        for i, line in enumerate(lines, 1):
+            m = _DEFINE_RE.match(line)
+            if m:
+                name = m.group(1)
+                val = m.group(2).strip()
+                macros[name] = val
+                defines_lines[name] = i
 
         # 関連マクロを抽出し、実際の値を再帰展開（簡易）
         resolved = {}
         related = {}
 
-        token_re = re.compile(r'\b([A-Za-z_][A-Za-z0-9_]*)\b')
+        token_re = _TOKEN_RE
         def resolve(name, seen=None, depth=0):
             if name in resolved:
                 return resolved[name]
@@ -57,15 +68,17 @@ class MacroTable:
             resolve(n)
 
         # 使用箇所を探す（ソース内での出現）
+        # マクロ名ごとに re.search すると「行数 x マクロ数」回の走査になるので、
+        # 各行を単語（\w+ の連続）に 1回だけ分割し、マクロ名の set と突き合わせる。
+        # 単語単位の一致は (?<![\w_])name(?![\w_]) と同じ境界条件になる。
         usages = {}
-        try:
-            with open(self.src_file, 'r', encoding='utf-8', errors='ignore') as f:
-                for i, line in enumerate(f, 1):
-                    for name in macros.keys():
-                        if re.search(r'(?<![\w_])' + re.escape(name) + r'(?![\w_])', line):
-                            usages.setdefault(name, []).append(i)
-        except Exception:
-            pass
+        if macros:
+            word_re = _WORD_RE
+            names = set(macros)
+            for i, line in enumerate(lines, 1):
+                words = line_words[i - 1] if line_words is not None else word_re.findall(line)
+                for name in names.intersection(words):
+                    usages.setdefault(name, []).append(i)
 
         table = []
         for name in macros.keys():
@@ -73,4 +86,11 @@ class MacroTable:
             rels = related.get(name, [])
             file_and_lines = [self.src_file, usages.get(name, [])]
             table.append([name, actual, rels, file_and_lines])
-        return table
\ No newline at end of file
+        return table
+
+    def make_dict(self):
+        """
+        make() の結果を {マクロ名: 実際の値} の dict で返す。
+        マクロ名から値を引くだけならこちらを使う。
+        """
+        return {row[0]: row[1] for row in self.make()}
@@ -0,0 +1,67 @@
+from array import array
+from bisect import bisect_right
+
+
+class PreprocLineMap:
+    """
+    プリプロセス後の行番号 -> (元ファイル, 元の行番号) の対応表。
+
+    全行分の dict を持たず、linemarker（# 12 "foo.c"）の行だけを記録して
+    get() のたびに二分探索で求める。従来の preproc_map（dict）と同じく
+    get(pre_ln) / in / [] / len() / bool() で使える。
+
+      - linemarker 行:         (その linemarker のファイル, その linemarker の行番号)
+      - linemarker 以降の行:   (直前の linemarker のファイル, 行番号 + 経過行数 - 1)
+      - 最初の linemarker 以前: (pre_path, pre_ln)
+      - 1..n_lines の範囲外:    なし（get は default を返す）
+    """
+
+    def __init__(self, pre_path: str, n_lines: int):
+        self.pre_path = pre_path
+        self.n_lines = n_lines
+        # linemarker の情報を並列リストで持つ（_pre_lines を bisect する）
+        # 行番号は int オブジェクトのリストではなく 32bit 整数の array で詰めて持つ
+        # （clang の linemarker の行番号は 2147483647 以下）
+        self._pre_lines = array('i')
+        self._files = []
+        self._orig_lines = array('i')
+
+    def add_directive(self, pre_ln: int, orig_file: str, orig_ln: int) -> None:
+        """linemarker を追加する（pre_ln の昇順で呼ぶこと）。"""
+        self._pre_lines.append(pre_ln)
+        self._files.append(orig_file)
+        self._orig_lines.append(orig_ln)
+
+    def files(self) -> list:
+        """linemarker に出てくるファイル名（重複なし・出現順）。"""
+        return list(dict.fromkeys(self._files))
+
+    def get(self, pre_ln, default=None):
+        try:
+            pre_ln = int(pre_ln)
+        except (TypeError, ValueError):
+            return default
+        if pre_ln < 1 or pre_ln > self.n_lines:
+            return default
+        i = bisect_right(self._pre_lines, pre_ln) - 1
+        if i < 0:
+            return (self.pre_path, pre_ln)
+        d = self._pre_lines[i]
+        if d == pre_ln:
+            return (self._files[i], self._orig_lines[i])
+        return (self._files[i], self._orig_lines[i] + (pre_ln - d - 1))
+
+    def __getitem__(self, pre_ln):
+        v = self.get(pre_ln)
+        if v is None:
+            raise KeyError(pre_ln)
+        return v
+
+    def __contains__(self, pre_ln) -> bool:
+        return self.get(pre_ln) is not None
+
+    def __len__(self) -> int:
+        return self.n_lines
+
+    def __bool__(self) -> bool:
+        return self.n_lines > 0
@@ -0,0 +1,33 @@
+import re
+
+from .MacroTable import MacroTable
+from .TypeTable import TypeTable
+
+_WORD_RE = re.compile(r'\w+')
+
+class SymbolTables:
+    """
+    マクロ展開表と型変換（typedef）テーブルをまとめて作る。
+    返却形式: (MacroTable.make() の結果, TypeTable.make() の結果)
+    コンストラクタ引数は (src_file=..., compile_args=...) 固定。
+    両方の表が必要な場合、ソースの読み込みと各行の単語分割を 1回で済ませる。
+    """
+    def __init__(self, src_file="example.c", compile_args=None):
+        self.src_file = src_file
+        self.compile_args = compile_args or ["-std=c11", "-Iinclude"]
+
+    def make(self):
+        macro_table = MacroTable(src_file=self.src_file, compile_args=self.compile_args)
+        type_table = TypeTable(src_file=self.src_file, compile_args=self.compile_args)
+        try:
+            with open(self.src_file, 'r', encoding='utf-8', errors='ignore') as f:
+                lines = f.readlines()
+        except Exception:
+            # 読めない場合は個別に make() したときと同じ結果（マクロ表は空、型表は基本型のみ）
+            return [], type_table.make(lines=[])
+
+        # 使用箇所の走査はどちらも「行の単語 x 名前の set」なので、単語分割は共有する
+        word_re = _WORD_RE
+        line_words = [word_re.findall(line) for line in lines]
+        return (macro_table.make(lines=lines, line_words=line_words),
+                type_table.make(lines=lines, line_words=line_words))
@@ -1,5 +1,11 @@
 import re
 
+# よく使う正規表現はモジュール読み込み時に 1回だけコンパイルしておく
+_TYPEDEF_RE = re.compile(r'^\s*typedef\s+(.*?)\s+([A-Za-z_][A-ZaZ0-9_]*)\s*;\s*$')
+_TYPEDEF_TAG_RE = re.compile(r'^\s*typedef\s+(struct|enum)\b(.*)\b([A-Za-z_][A-Za_z0-9_]*)\s*;\s*$')
+_TOKEN_RE = re.compile(r'\b([A-Za-z_][A-Za-z0-9_]*)\b')
+_WORD_RE = re.compile(r'\w+')
+
 # 追加: typedef テーブル（型別名テーブル）
 class TypeTable:
     """
@@ -13,29 +19,33 @@ class TypeTable:
         self.src_file = src_file
         self.compile_args = compile_args or ["-std=c11", "-Iinclude"]
 
-    def make(self):
+    def make(self, lines=None, line_words=None):
+        # lines / line_words（各行の \w+ のリスト）を渡された場合はそれを使う（SymbolTables から共有）
         typedefs = {}    # alias -> base textual
         def_lines = {}   # alias -> def line
-        try:
-            with open(self.src_file, 'r', encoding='utf-8', errors='ignore') as f:
-                for i, line in enumerate(f, 1):
-                    # 単純系 typedef: "typedef <base> <alias>;" にマッチ
-                    m = re.match(r'^\s*typedef\s+(.*?)\s+([A-Za-z_][A-ZaZ0-9_]*)\s*;\s*$', line)
-                    if m:
-                        base = m.group(1).strip()
-                        alias = m.group(2).strip()
-                        typedefs[alias] = base
-                        def_lines[alias] = i
-                    else:
-                        # struct/enum typedef なども単純に拾う（例: typedef struct X Y;）
-                        m2 = re.match(r'^\s*typedef\s+(struct|enum)\b(.*)\b([A-Za-z_][A-Za_z0-9_]*)\s*;\s*$', line)
-                        if m2:
-                            alias = m2.group(3).strip()
-                            base = ' '.join([m2.group(1), m2.group(2).strip()]).strip()
-                            typedefs[alias] = base
-                            def_lines[alias] = i
-        except Exception:
-            pass
+        # ソースは 1回だけ読み、typedef の収集と使用箇所の走査で使い回す
+        if lines is None:
+            try:
+                with open(self.src_file, 'r', encoding='utf-8', errors='ignore') as f:
+                    lines = f.readlines()
+            except Exception:
+                lines = []
+        for i, line in enumerate(lines, 1):
+            # 単純系 typedef: "typedef <base> <alias>;" にマッチ
+            m = _TYPEDEF_RE.match(line)
+            if m:
+                base = m.group(1).strip()
+                alias = m.group(2).strip()
+                typedefs[alias] = base
+                def_lines[alias] = i
+            else:
+                # struct/enum typedef なども単純に拾う（例: typedef struct X Y;）
+                m2 = _TYPEDEF_TAG_RE.match(line)
+                if m2:
+                    alias = m2.group(3).strip()
+                    base = ' '.join([m2.group(1), m2.group(2).strip()]).strip()
+                    typedefs[alias] = base
+                    def_lines[alias] = i
 
         # 基本的な整数型を自分自身に紐付けておく（見つからない場合にも対応）
         for t in ("int8_t","int16_t","int32_t","int64_t",
@@ -49,8 +59,11 @@ class TypeTable:
         # 依存解決: 別名→実体 を再帰的に解決
         resolved = {}
         related = {}
+        # 別名でない型表記（"unsigned int" や自分自身に紐付けた基本型）の展開結果。
+        # 基本型は自分自身に展開され続けて深さ上限まで再帰するので、(表記, seen) 単位でメモする
+        resolved_text = {}
 
-        name_token = re.compile(r'\b([A-Za-z_][A-Za-z0-9_]*)\b')
+        name_token = _TOKEN_RE
         def resolve_type(name, seen=None, depth=0):
             # name は textual 型表記または alias
             if depth > 50:
@@ -75,6 +88,9 @@ class TypeTable:
                 related[name] = sorted(list(rels))
                 return new_base
             # 文字列として解析して既知の alias が含まれる場合、それらを展開
+            memo_key = (name, frozenset(seen))
+            if memo_key in resolved_text:
+                return resolved_text[memo_key]
             s = name
             rels = set()
             def repl2(tok):
@@ -83,21 +99,30 @@ class TypeTable:
                     return resolve_type(tok, seen.copy(), depth+1)
                 return tok
             new_s = name_token.sub(lambda mo: repl2(mo.group(1)), s)
+            resolved_text[memo_key] = new_s
             return new_s
 
         for alias in list(typedefs.keys()):
             resolve_type(alias)
 
         # 使用箇所をソースから収集
+        # 別名ごとに re.search すると「行数 x 別名数」回の走査になるので、
+        # 各行を単語（\w+ の連続）に 1回だけ分割し、1 語の別名の set と突き合わせる。
+        # 単語単位の一致は (?<![\w_])name(?![\w_]) と同じ境界条件になる。
+        # "unsigned int" のような複数語の型名は単語 1 つにならないため個別に検索する。
         usages = {}
-        try:
-            with open(self.src_file, 'r', encoding='utf-8', errors='ignore') as f:
-                for i, line in enumerate(f, 1):
-                    for alias in typedefs.keys():
-                        if re.search(r'(?<![\w_])' + re.escape(alias) + r'(?![\w_])', line):
-                            usages.setdefault(alias, []).append(i)
-        except Exception:
-            pass
+        word_re = _WORD_RE
+        word_names = {a for a in typedefs.keys() if word_re.fullmatch(a)}
+        multi_res = [(a, re.compile(r'(?<![\w_])' + re.escape(a) + r'(?![\w_])'))
+                     for a in typedefs.keys() if not word_re.fullmatch(a)]
+        for i, line in enumerate(lines, 1):
+            words = line_words[i - 1] if line_words is not None else word_re.findall(line)
+            found = word_names.intersection(words)
+            for alias, pat in multi_res:
+                if pat.search(line):
+                    found.add(alias)
+            for alias in found:
+                usages.setdefault(alias, []).append(i)
 
         table = []
         for alias in typedefs.keys():
@@ -105,4 +130,11 @@ class TypeTable:
             rels = related.get(alias, [])
             file_and_lines = [self.src_file, usages.get(alias, [])]
             table.append([alias, actual, rels, file_and_lines])
-        return table
\ No newline at end of file
+        return table
+
+    def make_dict(self):
+        """
+        make() の結果を {型名: 実際の型} の dict で返す。
+        名前から引くだけの利用側（SignedTypeFixer など）はこちらを使う。
+        """
+        return {row[0]: row[1] for row in self.make()}
@@ -2,3 +2,6 @@ from . import CodeAnalyzer
 from . import MacroTable
 from . import TypeTable
 from . import FunctionTable
+from . import PreprocLineMap
+from . import SymbolTables
+from . import DebugLog
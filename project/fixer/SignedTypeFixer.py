@@ -1,29 +1,60 @@
 from typing import Optional
 from clang import cindex
 import re
+from analyzer.DebugLog import getDebugLogger, flushDebugLog
 
 DEF_DEBUG=True
+_DBG_LOG = getDebugLogger("SignedTypeFixerDBG")
 
 class SignedTypeFixer:
+    _TOKEN_RE = re.compile(r'\b([A-Za-z_][A-Za-z0-9_]*)\b')
+    _CV_QUAL_RE = re.compile(r'\b(const|volatile)\b')
+    _INT_LITERAL_RE = re.compile(r'(?P<num>0[xX][0-9A-Fa-f]+|0[0-7]*|[0-9]+)(?P<suf>[uUlL]{0,3})')
+    _NUMERIC_LITERAL_RE = re.compile(r'[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?[uUlLfF]*')
+    _SIMPLE_OPERAND_RE = re.compile(r'^[\w\d_]+$')
+    # "unsigned..." 以外で unsigned とみなす型名
+    _UNSIGNED_TYPES = frozenset(("uint8_t", "uint16_t", "uint32_t", "uint64_t", "unsigned char"))
+    # 整数型とみなす型名（const/volatile 除去・空白正規化後）
+    _INTEGER_TYPES = frozenset((
+        "bool",
+        "char", "signed char", "unsigned char",
+        "int", "signed", "unsigned", "unsigned int",
+        "int8_t", "int16_t", "int32_t", "int64_t",
+        "uint8_t", "uint16_t", "uint32_t", "uint64_t",
+    ))
+
     def __init__(self, src_file="example.c", compile_args=None, macro_table=None, type_table=None):
         self.src_file = src_file
         self.compile_args = compile_args or ["-std=c11", "-Iinclude"]
         self._type_table = type_table or []
 
         # TypeTable: [ [alias, actual, related, [file,[lines...]]], ... ]
+        # TypeTable.make_dict() の {alias: actual} もそのまま受け付ける
         self._type_map = {}
         try:
-            for row in self._type_table:
-                if isinstance(row, (list, tuple)) and len(row) >= 2:
-                    self._type_map[str(row[0]).strip()] = str(row[1]).strip()
+            if isinstance(self._type_table, dict):
+                for alias, actual in self._type_table.items():
+                    self._type_map[str(alias).strip()] = str(actual).strip()
+            else:
+                for row in self._type_table:
+                    if isinstance(row, (list, tuple)) and len(row) >= 2:
+                        self._type_map[str(row[0]).strip()] = str(row[1]).strip()
         except Exception:
             self._type_map = {}
+        # 型表記 -> typedef 展開後の型（_actual_type_from_typetable のメモ）
+        self._actual_cache = {}
+        # 型表記 -> const/volatile を落とした型（_strip_cv のメモ）
+        self._cv_cache = {}
 
     def _actual_type_from_typetable(self, type_str: str) -> str:
         if not type_str:
             return ""
-        s = " ".join(str(type_str).split())
-        token_re = re.compile(r'\b([A-Za-z_][A-Za-z0-9_]*)\b')
+        key = str(type_str)
+        cached = self._actual_cache.get(key)
+        if cached is not None:
+            return cached
+        s = " ".join(key.split())
+        token_re = self._TOKEN_RE
 
         def repl(m):
             tok = m.group(1)
@@ -37,23 +68,30 @@ class SignedTypeFixer:
             prev = cur
             cur = token_re.sub(repl, cur)
             cur = " ".join(cur.split())
+        self._actual_cache[key] = cur
         return cur
 
     def _normalize_actual_type(self, type_str: str) -> str:
         return self._actual_type_from_typetable(type_str) or (type_str or "").strip()
 
+    def _strip_cv(self, type_str: str) -> str:
+        """const/volatile を落として空白を正規化する。"""
+        s = type_str or ""
+        cached = self._cv_cache.get(s)
+        if cached is not None:
+            return cached
+        # 修飾子が無い（ほとんどの）場合は正規表現を通さない
+        if "const" in s or "volatile" in s:
+            stripped = " ".join(self._CV_QUAL_RE.sub('', s).split())
+        else:
+            stripped = " ".join(s.split())
+        self._cv_cache[s] = stripped
+        return stripped
+
     def _is_integer_type(self, actual_type: str) -> bool:
-        s = (actual_type or "")
-        s = re.sub(r'\b(const|volatile)\b', '', s)
-        s = " ".join(s.split())
-
-        if s in (
-            "bool",
-            "char", "signed char", "unsigned char",
-            "int", "signed", "unsigned", "unsigned int",
-            "int8_t", "int16_t", "int32_t", "int64_t",
-            "uint8_t", "uint16_t", "uint32_t", "uint64_t",
-        ):
+        s = self._strip_cv(actual_type)
+
+        if s in self._INTEGER_TYPES:
             return True
 
         # ざっくり *_t の整数型も許可
@@ -62,24 +100,17 @@ class SignedTypeFixer:
         return False
 
     def _is_unsigned(self, actual_type: str) -> bool:
-        s = (actual_type or "")
-        s = re.sub(r'\b(const|volatile)\b', '', s)
-        s = " ".join(s.split())
-
-        if s.startswith("unsigned"):
-            return True
-        if s in ("uint8_t", "uint16_t", "uint32_t", "uint64_t", "unsigned char"):
-            return True
+        s = self._strip_cv(actual_type)
         # char は処理系依存なので unsigned 扱いにしない
-        return False
+        return s.startswith("unsigned") or s in self._UNSIGNED_TYPES
 
     def _is_integer_literal_token(self, txt: str) -> bool:
         s = (txt or "").strip()
-        return bool(re.fullmatch(r'(0[xX][0-9A-Fa-f]+|0[0-7]*|[0-9]+)([uUlL]{0,3})', s))
+        return bool(self._INT_LITERAL_RE.fullmatch(s))
 
     def _toggle_unsigned_literal_suffix(self, txt: str, make_unsigned: bool) -> str:
         s = (txt or "").strip()
-        m = re.fullmatch(r'(?P<num>0[xX][0-9A-Fa-f]+|0[0-7]*|[0-9]+)(?P<suf>[uUlL]{0,3})', s)
+        m = self._INT_LITERAL_RE.fullmatch(s)
         if not m:
             return s
         num = m.group("num")
@@ -94,15 +125,27 @@ class SignedTypeFixer:
             # U/u だけ除去（Lは残す）
             return num + "".join([c for c in suf if c not in ("u", "U")])
 
+    def _dbg(self, *args):
+        # 出力は CodeAnalyzer と同じ DebugLog の共有バッファに貯まる
+        if DEF_DEBUG:
+            _DBG_LOG.debug(" ".join([str(a) for a in args]))
+
+    def _flush_dbg(self):
+        flushDebugLog()
+
     def solveSignedTypedConflict(self, analize_result):
         """
         解析結果から符号型不一致を検出し、必要ならキャストを挿入した式文字列を返す。
         Step5: unsigned/signedが一致していても型が異なればキャストする。
         left_type == right_type の場合のみ型変換は行わない。
         """
-        def dbg(*args):
-            if DEF_DEBUG:
-                print("[SignedTypeFixerDBG]", *args)
+        try:
+            return self._solveSignedTypedConflict(analize_result)
+        finally:
+            self._flush_dbg()
+
+    def _solveSignedTypedConflict(self, analize_result):
+        dbg = self._dbg
 
         # --- 1. eval_datas 取得 ---
         eval_datas = analize_result.get("eval_datas", [])
@@ -127,33 +170,46 @@ class SignedTypeFixer:
             if cursor is None:
                 dbg("get_types: cursor is None")
                 return None, None
-            try:
-                # デバッグ: cursor情報
+            # 再帰せず明示スタックで preorder に探索し、最初に型が取れた
+            # DECL_REF_EXPR / INTEGER_LITERAL の型を返す
+            stack = [cursor]
+            while stack:
+                node = stack.pop()
                 try:
-                    dbg("get_types: cursor.spelling =", getattr(cursor, "spelling", "<no spelling>"))
-                    dbg("get_types: cursor.kind =", getattr(cursor, "kind", "<no kind>"))
-                    dbg("get_types: cursor.type.spelling =", getattr(getattr(cursor, "type", None), "spelling", "<no type>"))
-                    dbg("get_types: cursor.type.get_canonical().spelling =", getattr(getattr(cursor, "type", None).get_canonical(), "spelling", "<no canonical>") if getattr(cursor, "type", None) else "<no type>")
-                except Exception as e:
-                    dbg("get_types: debug info error:", e)
-                # DECL_REF_EXPRやINTEGER_LITERALなら型を返す
-                if hasattr(cursor, "kind"):
-                    if cursor.kind.name == "DECL_REF_EXPR" or cursor.kind.name == "INTEGER_LITERAL":
-                        type_spelling = getattr(getattr(cursor, "type", None), "spelling", None)
+                    # kind / type / canonical 型はノードごとに 1回だけ取り、デバッグ出力と判定で共用する
+                    kind = getattr(node, "kind", None)
+                    try:
+                        node_type = getattr(node, "type", None)
+                        type_spelling = getattr(node_type, "spelling", None)
+                    except Exception:
+                        node_type, type_spelling = None, None
+                    try:
+                        canonical_spelling = node_type.get_canonical().spelling if node_type is not None else None
+                    except Exception:
                         canonical_spelling = None
-                        try:
-                            canonical_spelling = cursor.type.get_canonical().spelling
-                        except Exception:
-                            canonical_spelling = None
-                        dbg("get_types: return type =", type_spelling, "canonical =", canonical_spelling)
-                        return type_spelling, canonical_spelling
-                # 子ノードを再帰的に探索
-                for child in getattr(cursor, "get_children", lambda: [])():
-                    t, c = get_types(child)
-                    if t or c:
-                        return t, c
-            except Exception as e:
-                dbg("get_types: exception", e)
+                    # デバッグ: cursor情報
+                    try:
+                        dbg("get_types: cursor.spelling =", getattr(node, "spelling", "<no spelling>"))
+                        dbg("get_types: cursor.kind =", kind if kind is not None else "<no kind>")
+                        dbg("get_types: cursor.type.spelling =", type_spelling if node_type is not None else "<no type>")
+                        dbg("get_types: cursor.type.get_canonical().spelling =", canonical_spelling if node_type is not None else "<no type>")
+                    except Exception as e:
+                        dbg("get_types: debug info error:", e)
+                    # DECL_REF_EXPRやINTEGER_LITERALなら型を返す
+                    if kind is not None:
+                        kind_name = kind.name
+                        if kind_name == "DECL_REF_EXPR" or kind_name == "INTEGER_LITERAL":
+                            dbg("get_types: return type =", type_spelling, "canonical =", canonical_spelling)
+                            if type_spelling or canonical_spelling:
+                                return type_spelling, canonical_spelling
+                            # 型が取れなければ子は見ずに次の兄弟へ（従来の再帰と同じ）
+                            continue
+                    # 子ノードを探索（先頭の子から見るため逆順に積む）
+                    children = list(getattr(node, "get_children", lambda: [])())
+                    children.reverse()
+                    stack.extend(children)
+                except Exception as e:
+                    dbg("get_types: exception", e)
             return None, None
 
         left_type, left_type_canon = get_types(left_cursor)
@@ -166,9 +222,8 @@ class SignedTypeFixer:
 
         # --- 3. unsigned/signed判定はcanonical型で ---
         def is_primitive_int(t):
-            return any(x in t for x in [
-                "int", "uint", "int8", "int16", "int32", "int64", "unsigned", "signed"
-            ])
+            # "uint"/"int8".. は "int" を、"unsigned" は "signed" を含むので 2つの部分一致で足りる
+            return "int" in t or "signed" in t
         def is_unsigned(t):
             return "unsigned" in t or t.strip().startswith("u")
 
@@ -179,8 +234,10 @@ class SignedTypeFixer:
         dbg("STEP3: left_is_int", left_is_int, "right_is_int", right_is_int, "left_is_unsigned", left_is_unsigned, "right_is_unsigned", right_is_unsigned)
 
         # --- 4. 単行式・定数判定 ---
+        numeric_literal_re = self._NUMERIC_LITERAL_RE
+
         def is_numeric_literal(s):
-            return bool(re.fullmatch(r'[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?[uUlLfF]*', str(s).strip()))
+            return bool(numeric_literal_re.fullmatch(str(s).strip()))
 
         left_is_const = is_numeric_literal(left_val)
         dbg("left_is_const(after is_numeric_literal):", left_is_const)
@@ -230,7 +287,7 @@ class SignedTypeFixer:
                     return self._toggle_unsigned_literal_suffix(expr, make_unsigned)
                 else:
                     # 変数や式の場合はキャスト
-                    if re.match(r'^[\w\d_]+$', str(expr)):
+                    if self._SIMPLE_OPERAND_RE.match(str(expr)):
                         return f"({ctype}){expr}"
                     else:
                         return f"({ctype})({expr})"
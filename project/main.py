@@ -24,6 +24,23 @@ class CommitManager:
         self.user_email = user_email
         self.token = token
 
+    def _load_source(self, input_path: str):
+        """
+        入力ファイルを bytes で 1回だけ読み、行頭オフセットと一緒に返す。
+        offsets[i] は i+1 行目の先頭、offsets[-1] はファイル末尾。
+        外部で書き換えられていても古い内容に継ぎ足さないよう、呼ぶたびに読み直す（キャッシュしない）。
+        """
+        with open(input_path, 'rb') as rf:
+            data = rf.read()
+        offsets = [0]
+        i = data.find(b'\n')
+        while i != -1:
+            offsets.append(i + 1)
+            i = data.find(b'\n', i + 1)
+        if offsets[-1] != len(data):
+            offsets.append(len(data))  # 末尾に改行が無い最終行
+        return data, offsets
+
     def _compute_column(self, before_line: str, after_line: str) -> int:
         if before_line is None:
             return 1
@@ -46,23 +63,43 @@ class CommitManager:
           置換対象行(lines[ln-1])の先頭にあるインデント（空白/タブ）を維持する。
           txt の先頭にも同じインデントを付けて、変更前後で先頭位置が揃うようにする。
         """
+        records = self.makeOutputFileLines(input_path, output_path, [(None, ln, txt)])
+        return bool(records) and records[0][2]
+
+    def makeOutputFileLines(self, input_path: str, output_path: str, edits) -> list:
+        """
+        makeOutputFile の複数行版。edits（[(指摘番号, ln, txt), ...]）をまとめて置換し、
+        入力の読み込みと出力の書き込みを 1回ずつで済ませる。
+
+        返り値:
+          edits と同じ並びの [指摘番号, 行番号, 置換できたか, 置換後の行] のリスト
+          （perform に渡す fixer の結果と同じ形。置換後の行はインデント付き・改行なし）。
+          置換できない行は飛ばし、1行も置換できなければ出力しない。
+          出力に失敗した場合はすべて False。
+        """
+        edits = list(edits or [])
+        results = [[idx_id, ln, False, txt] for idx_id, ln, txt in edits]
         try:
-            with open(input_path, 'r', encoding='utf-8', errors='ignore') as rf:
-                lines = rf.readlines()
+            data, offsets = self._load_source(input_path)
         except Exception:
-            return False
+            return results
 
-        new_lines = list(lines)
-
-        try:
-            if txt is not None and ln is not None:
+        repl = {}  # 行番号 -> 置換後の bytes（同じ行は後の指定を優先）
+        for i, (_, ln, txt) in enumerate(edits):
+            try:
+                if txt is None or ln is None:
+                    results[i][2] = True
+                    continue
                 ln = int(ln)
-                if ln < 1 or ln > len(new_lines):
-                    return False
+                if ln < 1 or ln > len(offsets) - 1:
+                    continue
+
+                # 対象行だけを bytes から切り出してデコードする
+                before = data[offsets[ln - 1]:offsets[ln]].decode('utf-8', errors='ignore')
+                eol = "\r\n" if before.endswith("\r\n") else "\n"
 
                 # 追加: 元行の先頭インデント（空白/タブ）を抽出して txt に付与
                 try:
-                    before = new_lines[ln - 1]
                     indent = re.match(r'^[ \t]*', before).group(0)
                 except Exception:
                     indent = ""
@@ -71,11 +108,26 @@ class CommitManager:
                 txt_norm = txt.lstrip(' \t')
                 txt = indent + txt_norm
 
+                results[i][3] = txt.rstrip("\r\n")
                 if not txt.endswith("\n"):
-                    txt = txt + "\n"
-                new_lines[ln - 1] = txt
-        except Exception:
-            return False
+                    txt = txt + eol
+                repl[ln] = txt.encode('utf-8')
+                results[i][2] = True
+            except Exception:
+                continue
+
+        if edits and not any(r[2] for r in results):
+            return results
+
+        # 置換行の前後を元の bytes から切り出してつなぐ
+        pieces = []
+        pos = 0
+        for ln in sorted(repl):
+            pieces.append(data[pos:offsets[ln - 1]])
+            pieces.append(repl[ln])
+            pos = offsets[ln]
+        pieces.append(data[pos:])
+        new_data = b"".join(pieces)
 
         out_dir = os.path.dirname(output_path) or "."
         try:
@@ -83,13 +135,45 @@ class CommitManager:
         except Exception:
             pass
 
+        # 一時ファイルに書いてから os.replace で差し替える。
+        # 書き込みに失敗しても出力先は元のまま残る（途中まで書かれた状態にならない）
+        tmp_path = None
         try:
-            with open(output_path, 'w', encoding='utf-8') as wf:
-                wf.writelines(new_lines)
-            return True
+            fd, tmp_path = self._create_temp_file(out_dir, os.path.basename(output_path))
+            with os.fdopen(fd, 'wb') as wf:
+                wf.write(new_data)
+            # 既存ファイルがあればその権限に合わせる（無ければ作成時の 0666 & ~umask のまま）
+            if os.path.exists(output_path):
+                shutil.copymode(output_path, tmp_path)
+            os.replace(tmp_path, output_path)
+            tmp_path = None
+            return results
         except Exception:
-            return False
-        return False
+            for r in results:
+                r[2] = False
+            return results
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except Exception:
+                    pass
+
+    @staticmethod
+    def _create_temp_file(out_dir: str, base_name: str):
+        """
+        out_dir に一時ファイルを新規作成し (fd, path) を返す。
+        mkstemp（0600 固定）ではなく 0666 で作り、umask はカーネルに適用させる
+        （os.umask で読み取るとプロセス全体の umask を一瞬書き換えてしまうため）。
+        """
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+        for _ in range(tempfile.TMP_MAX):
+            path = os.path.join(out_dir, f".{base_name}.{os.urandom(6).hex()}.tmp")
+            try:
+                return os.open(path, flags, 0o666), path
+            except FileExistsError:
+                continue
+        raise FileExistsError(f"no usable temporary file name in {out_dir}")
 
     def perform(self, commit_flag: str, result, src_path: str, message=None):
         """
@@ -668,6 +752,9 @@ if __name__ == "__main__":
     
     #指摘表([指摘番号,行番号])
     chlist = [[0,106]]
+    # 指摘ごとの修正は (指摘番号, 行番号, 変換結果) として貯め、ループ後に 1回でファイルへ書く
+    pending_edits = []
+    fix_results = {}  # 指摘番号 -> fixer の結果（commit message に使う）
     for coords in chlist:
         
         print("--------------------------[ Analyze Start ] --------------------------")
@@ -723,15 +810,19 @@ if __name__ == "__main__":
         exit(1)
         print("--------------------------[ Cast Finish ] --------------------------")
 
-        # ここで出力ファイルを生成（入力=出力で上書き）
-        wrote = mgr.makeOutputFile(src, src, coords[1], txt)
-        print("makeOutputFile wrote:", wrote)
+        pending_edits.append((coords[0], coords[1], txt))
+        fix_results[coords[0]] = res
 
+    # ここで出力ファイルを生成（入力=出力で上書き）。全指摘の修正を 1回の読み書きで反映する
+    # 行番号は指摘表（修正前のソース）のものなので、書き込みは全行の解析が終わってから行う
+    records = mgr.makeOutputFileLines(src, src, pending_edits)
+    print("makeOutputFileLines wrote:", records)
 
-        # ファイル化ができたら perform を呼び出し、res を commit message として渡す
-        if wrote:
-            op_res = mgr.perform("1", res, src, message=res)
-        else:
-            op_res = {"ok": False, "reason": "makeOutputFile failed"}
+    # ファイル化ができたら perform を呼び出し、修正できた指摘の res をまとめて commit message として渡す
+    wrote = [r for r in records if r[2]]
+    if wrote:
+        op_res = mgr.perform("1", wrote[0], src, message=[fix_results.get(r[0]) for r in wrote])
+    else:
+        op_res = {"ok": False, "reason": "makeOutputFile failed"}
 
-        print("CommitManager result:", op_res)
\ No newline at end of file
+    print("CommitManager result:", op_res)
\ No newline at end of file